@@ -0,0 +1,147 @@
+"""
+Offline benchmark
+
+Runs BotChucky against bot_chucky.stubs.StubServer, a local stand-in for
+graph.facebook.com, Open Weather and StackExchange, and reports throughput
+and p50/p99 latency for every scenario and concurrency level.
+
+Usage:
+    python benchmarks/bench.py --concurrency 1,8,32 --calls 500 --latency 0.02
+    python benchmarks/bench.py --json results.json
+
+Save the JSON output of two runs to compare a change against a baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_chucky.bot import BotChucky  # noqa: E402
+from bot_chucky.helpers import ChuckyCustomGenerator  # noqa: E402
+from bot_chucky.replay import percentile  # noqa: E402
+from bot_chucky.stubs import StubServer  # noqa: E402
+from bot_chucky.transport import Transport  # noqa: E402
+
+CITIES = [f'City {i}' for i in range(50)] + ['Nowhere']
+TITLES = [f'Update Django {i}' for i in range(50)]
+
+
+def make_generator():
+    generator = ChuckyCustomGenerator()
+    config = {f'#tag{i}': (lambda i=i: f'tag {i}') for i in range(1000)}
+    config['#Python'] = {'news': lambda: 'Python news!',
+                         'jobs': lambda: 'Python jobs!'}
+    generator.config = config
+    return generator
+
+
+def scenarios(bot, generator):
+    """
+    :return: dictionary {name: function(call number)}
+    """
+    return {
+        'send_message': lambda i: bot.send_message(str(i), 'Hello!'),
+        'send_weather_message': lambda i: bot.send_weather_message(
+            str(i), CITIES[i % len(CITIES)]
+        ),
+        'send_stack_questions': lambda i: bot.send_stack_questions(
+            str(i), title=TITLES[i % len(TITLES)]
+        ),
+        'generator_hit': lambda i: generator(
+            'Hey #Python and send me your news please'
+        ),
+        'generator_miss': lambda i: generator(
+            'Hey there and send me something nice please'
+        ),
+    }
+
+
+def run(func, calls, concurrency):
+    """
+    :return: dictionary with throughput and latency percentiles
+    """
+    def timed(i):
+        start = time.perf_counter()
+        error = None
+        try:
+            func(i)
+        except Exception as exc:
+            error = exc
+        return time.perf_counter() - start, error
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(calls)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, error in results if error is not None)
+    return {
+        'calls': calls,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput': calls / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='comma separated concurrency levels')
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='stub latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--only', default=None,
+                        help='comma separated scenario names')
+    parser.add_argument('--json', default=None,
+                        help='write results to this file')
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    report = {
+        'python': platform.python_version(),
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'results': [],
+    }
+
+    with StubServer(latency=args.latency, jitter=args.jitter,
+                    error_rate=args.error_rate) as server:
+        generator = make_generator()
+        print(f'{"scenario":<22}{"conc":>6}{"calls/s":>12}'
+              f'{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for concurrency in levels:
+            transport = Transport(pool_maxsize=max(concurrency, 10))
+            bot = BotChucky('TOKEN', open_weather_token='TOKEN',
+                            transport=transport)
+            server.configure(bot)
+            for name, func in scenarios(bot, generator).items():
+                if args.only and name not in args.only.split(','):
+                    continue
+                result = run(func, args.calls, concurrency)
+                result['scenario'] = name
+                report['results'].append(result)
+                print(f'{name:<22}{concurrency:>6}'
+                      f'{result["throughput"]:>12.1f}'
+                      f'{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+                      f'{result["errors"]:>8}')
+            transport.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
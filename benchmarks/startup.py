@@ -0,0 +1,77 @@
+"""
+Startup benchmark
+
+Measures how long a fresh interpreter takes to import bot_chucky.bot and
+build a BotChucky instance, and checks that no third-party SDK is
+imported before it is needed.
+
+Usage:
+    python benchmarks/startup.py --runs 20 --max-ms 150
+
+Exits with status 1 when a lazy module was imported eagerly
+or the median startup time is above --max-ms.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which must not be imported by `import bot_chucky.bot`
+# and `BotChucky(token)` alone.
+LAZY_MODULES = ('facebook', 'twitter', 'soundcloud', 'requests', 'aiohttp')
+
+SNIPPET = '''
+import json, sys, time
+start = time.perf_counter()
+from bot_chucky.bot import BotChucky
+BotChucky('TOKEN', open_weather_token='TOKEN')
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'ms': elapsed * 1000,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (LAZY_MODULES,)
+
+
+def run_once():
+    """
+    :return: dictionary {'ms': startup time, 'loaded': eager modules}
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output([sys.executable, '-c', SNIPPET],
+                                     env=env, cwd=ROOT)
+    return json.loads(output.decode())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail when the median is above this value')
+    args = parser.parse_args(argv)
+
+    results = [run_once() for _ in range(args.runs)]
+    timings = sorted(result['ms'] for result in results)
+    loaded = sorted({name for result in results for name in result['loaded']})
+
+    print(f'runs: {args.runs}')
+    print(f'median: {statistics.median(timings):.2f} ms')
+    print(f'min: {timings[0]:.2f} ms, max: {timings[-1]:.2f} ms')
+
+    failed = False
+    if loaded:
+        print(f'FAIL: imported eagerly: {", ".join(loaded)}')
+        failed = True
+    if args.max_ms is not None and statistics.median(timings) > args.max_ms:
+        print(f'FAIL: median above {args.max_ms} ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
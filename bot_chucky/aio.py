@@ -0,0 +1,538 @@
+""" Asyncio counterparts of BotChucky and the helper classes """
+
+import asyncio
+import logging
+
+import aiohttp
+
+from .cache import TTLCache
+from .constants import (API_URL, GRAPH_URL, SOUNDCLOUD_API_URL,
+                        STACK_API_URL, WEATHER_API_URL)
+from .errors import BotChuckyTokenError, BotChuckyUpstreamError
+from .helpers import SoundCloudData, StackExchangeData, WeatherData
+from .messages import (action_payload, card_payload, image_payload,
+                       soundcloud_reply, stack_reply, text_payload,
+                       unavailable_reply, weather_reply)
+from .metrics import track
+from .transport import UPSTREAM_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# get_running_loop is new in Python 3.7, get_event_loop returns the
+# running loop in a coroutine on 3.6
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class AsyncTransport:
+    """
+    Class which owns a pooled aiohttp.ClientSession,
+    the asyncio counterpart of bot_chucky.transport.Transport
+    """
+    def __init__(self, limit=1000, limit_per_host=0, timeout=10,
+                 session=None):
+        """
+        :param limit: Max simultaneous connections, 0 is unlimited
+        :param limit_per_host: Max connections per host, 0 is unlimited
+        :param timeout: Total timeout of a request, seconds
+        :param session: Use an existing aiohttp.ClientSession, not required
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._session = session
+
+    @property
+    def session(self):
+        """
+        :return: aiohttp.ClientSession, created on first use
+        inside the running event loop
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def get_json(self, url, upstream='http', operation='request',
+                       **kwargs):
+        """
+        :param upstream: Upstream name used by metrics, e.g. 'graph'
+        :param operation: Operation name used by metrics
+        :return: (status, decoded json body), network errors, timeouts
+        and bodies which are not JSON raise BotChuckyUpstreamError
+        """
+        with track(upstream, operation) as call:
+            try:
+                async with self.session.get(url, **kwargs) as response:
+                    if response.status >= 400:
+                        call.status = response.status
+                    return response.status, \
+                        await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    ValueError) as error:
+                call.status = error.__class__.__name__
+                raise BotChuckyUpstreamError(upstream, repr(error)) \
+                    from error
+
+    async def post_json(self, url, upstream='http', operation='request',
+                        **kwargs):
+        """
+        :param upstream: Upstream name used by metrics, e.g. 'graph'
+        :param operation: Operation name used by metrics
+        :return: (status, body text), network errors and timeouts
+        raise BotChuckyUpstreamError
+        """
+        with track(upstream, operation) as call:
+            try:
+                async with self.session.post(url, **kwargs) as response:
+                    if response.status >= 400:
+                        call.status = response.status
+                    return response.status, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                call.status = error.__class__.__name__
+                raise BotChuckyUpstreamError(upstream, repr(error)) \
+                    from error
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class AsyncFacebookData:
+    graph_url = GRAPH_URL
+
+    def __init__(self, token, transport, cache_size=10000, cache_ttl=3600,
+                 cache=None):
+        """
+        :param token: Facebook Page token
+        :param transport: Instance of AsyncTransport
+        :param cache_size: Max number of user names kept in the cache
+        :param cache_ttl: Seconds a user name is reused, default 3600
+        :param cache: Cache backend, e.g. the one of a FacebookData,
+                      default a TTLCache of cache_size and cache_ttl
+        """
+        self.token = token
+        self.transport = transport
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+
+    async def get_user_name(self, _id):
+        """
+        :param _id: find user object by _id
+        :return: first name of user, type -> str
+        """
+        if not isinstance(_id, str):
+            raise ValueError('id must be a str')
+        name = self.cache.get(_id)
+        if name is not None:
+            return name
+
+        params = {'access_token': self.token, 'fields': 'first_name'}
+        _, user = await self.transport.get_json(
+            f'{self.graph_url}/{_id}', params=params,
+            upstream='graph', operation='get_user_name'
+        )
+        name = user.get('first_name') if user else None
+        if name is not None:
+            self.cache.set(_id, name)
+        return name
+
+
+class AsyncWeatherData:
+    """
+    Class which collect weather data
+    """
+    api_url = WEATHER_API_URL
+    normalize_city = staticmethod(WeatherData.normalize_city)
+
+    def __init__(self, api_token, transport, cache_size=256, cache_ttl=600,
+                 not_found_ttl=60, cache=None):
+        """
+        :param api_token: Open Weather TOKEN
+        :param transport: Instance of AsyncTransport
+        :param cache_size: Max number of cities kept in the cache
+        :param cache_ttl: Seconds a weather report is reused, default 600
+        :param not_found_ttl: Seconds an unknown city is remembered
+        :param cache: Cache backend, e.g. the one of a WeatherData,
+                      default a TTLCache of cache_size and cache_ttl
+        """
+        self.token = api_token
+        self.transport = transport
+        self.not_found_ttl = not_found_ttl
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+
+    def is_cached(self, city_name) -> bool:
+        """
+        :param city_name: City name as typed by a user, type -> str
+        :return: True when get_current_weather answers from the cache
+        """
+        return self.cache.get(self.normalize_city(city_name)) is not None
+
+    async def get_current_weather(self, city_name):
+        """
+        :param city_name: Open weather API, find by city name
+        :return dictionary object with information
+        """
+        key = self.normalize_city(city_name)
+        info = self.cache.get(key)
+        if info is not None:
+            return info
+
+        params = {'q': city_name, 'APPID': self.token}
+        try:
+            status, info = await self.transport.get_json(
+                self.api_url, params=params,
+                upstream='openweather', operation='current_weather'
+            )
+            if status in UPSTREAM_FAILURES:
+                raise BotChuckyUpstreamError(
+                    'openweather', f'Open Weather answered {status}')
+        except BotChuckyUpstreamError:
+            # Serve the last known weather while Open Weather is down
+            info = self.cache.get_stale(key)
+            if info is None:
+                raise
+            return info
+
+        if str(info.get('cod')) == '200':
+            self.cache.set(key, info)
+        elif str(info.get('cod')) == '404':
+            self.cache.set(key, info, ttl=self.not_found_ttl)
+        return info
+
+
+class AsyncStackExchangeData:
+    """
+    Class which collect StackExchange data.
+    Identical queries running at the same time share one request,
+    the backoff and quota are shared with StackExchangeData.
+    """
+    _default_parameters = StackExchangeData._default_parameters
+    _filter_fields = StackExchangeData._filter_fields
+    api_url = STACK_API_URL
+    quota = StackExchangeData.quota
+    build_query = StackExchangeData.build_query
+    cache_key = staticmethod(StackExchangeData.cache_key)
+    filter_url = StackExchangeData.filter_url
+
+    def __init__(self, transport, pagesize=2, filter=None, cache_size=512,
+                 cache_ttl=300, cache=None):
+        """
+        :param transport: Instance of AsyncTransport
+        :param pagesize: Number of questions requested, default 2
+        :param filter: StackExchange filter, default one created on
+                       first use which keeps only the question links
+        :param cache_size: Max number of queries kept in the cache
+        :param cache_ttl: Seconds a list of links is reused, default 300
+        :param cache: Cache backend, e.g. the one of a StackExchangeData,
+                      default a TTLCache of cache_size and cache_ttl
+        """
+        self.transport = transport
+        self.pagesize = pagesize
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+        self.filter = filter
+        self._flights = {}
+
+    async def get_filter(self):
+        """
+        :return: Name of a filter with only the fields the bot reads,
+        'default' when it could not be created
+        """
+        if self.filter is None:
+            params = {'include': self._filter_fields, 'base': 'none',
+                      'unsafe': 'false'}
+            try:
+                _, reply = await self.transport.get_json(
+                    self.filter_url, params=params,
+                    upstream='stackexchange', operation='create_filter'
+                )
+                self.filter = reply['items'][0]['filter']
+            except (BotChuckyUpstreamError, KeyError, IndexError,
+                    TypeError):
+                logger.warning('Could not create a StackExchange filter, '
+                               'using the default one')
+                self.filter = 'default'
+        return self.filter
+
+    async def _search(self, params):
+        self.quota.check()
+        params = dict(params, pagesize=str(self.pagesize),
+                      filter=await self.get_filter())
+        status, questions = await self.transport.get_json(
+            self.api_url, params=params,
+            upstream='stackexchange', operation='search'
+        )
+        if status in UPSTREAM_FAILURES:
+            raise BotChuckyUpstreamError(
+                'stackexchange', f'StackExchange answered {status}')
+        self.quota.update(questions)
+        if 'error_id' in questions:
+            raise BotChuckyUpstreamError(
+                'stackexchange', f'StackExchange answered '
+                                 f'{questions.get("error_name")}')
+        return [obj['link'] for obj in questions.get('items', [])]
+
+    async def get_stack_answer_by(self, **kwargs):
+        """
+        :param kwargs: create a query by arguments, title='Update Python'
+        :return: an array with links
+        """
+        params = self.build_query(**kwargs)
+        key = self.cache_key(params)
+        links = self.cache.get(key)
+        if links is not None:
+            return list(links)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            return list(await asyncio.shield(flight))
+
+        flight = self._flights[key] = _running_loop().create_future()
+        try:
+            links = await self._search(params)
+        except asyncio.CancelledError:
+            # The waiting tasks were not cancelled, they get an error
+            flight.set_exception(BotChuckyUpstreamError(
+                'stackexchange', 'The shared search was cancelled'))
+            flight.exception()
+            raise
+        except BaseException as exc:
+            flight.set_exception(exc)
+            # Nobody may be waiting, do not log it as never retrieved
+            flight.exception()
+            raise
+        else:
+            self.cache.set(key, links)
+            flight.set_result(links)
+            return list(links)
+        finally:
+            del self._flights[key]
+
+
+class AsyncSoundCloudData:
+    """
+    Class to gather soundcloud data over the public HTTP API.
+    Results are cached under the keys SoundCloudData uses, so passing
+    its cache shares the searches of the sync and async clients.
+
+    :Example:
+          sync = SoundCloudData(client_id, cache=SqliteCache(path))
+          aio = AsyncSoundCloudData(client_id, transport, cache=sync.cache)
+    """
+    api_url = SOUNDCLOUD_API_URL
+    cache_key = staticmethod(SoundCloudData.cache_key)
+
+    def __init__(self, client_id, transport, limit=10, cache_size=256,
+                 cache_ttl=600, cache=None):
+        """
+        :param client_id: Client ID, must be registered
+        :param transport: Instance of AsyncTransport
+        :param limit: Max artists and tracks requested per search
+        :param cache_size: Max number of searches kept in the cache
+        :param cache_ttl: Seconds a search result is reused, default 600
+        :param cache: Cache backend, e.g. the one of a SoundCloudData,
+                      default a TTLCache of cache_size and cache_ttl
+        """
+        self.client_id = client_id
+        self.transport = transport
+        self.limit = limit
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+
+    async def search(self, artist=None, limit=None):
+        """
+        :param artist: search by artist, returns tracks and info, type -> str
+        :param limit: Max artists and tracks requested, default self.limit
+        :return: dictionary {'success': True, 'artists': [usernames],
+                             'tracks': [titles]}
+        """
+        if artist is None:
+            return None
+
+        limit = limit or self.limit
+        key = self.cache_key(artist, limit)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        params = {'q': artist, 'client_id': self.client_id, 'limit': limit}
+        try:
+            (users_status, artists), (tracks_status, tracks) = \
+                await asyncio.gather(
+                    self.transport.get_json(f'{self.api_url}/users',
+                                            params=params,
+                                            upstream='soundcloud',
+                                            operation='users'),
+                    self.transport.get_json(f'{self.api_url}/tracks',
+                                            params=params,
+                                            upstream='soundcloud',
+                                            operation='tracks')
+                )
+        except BotChuckyUpstreamError as error:
+            return {'success': False, 'detail': f'Error: {error}'}
+
+        status = max(users_status, tracks_status)
+        if status != 200:
+            return {'success': False, 'detail': f'Code: {status}'}
+
+        result = {
+            'success': True,
+            'artists': [user['username'] for user in artists],
+            'tracks': [item['title'] for item in tracks]
+        }
+        self.cache.set(key, result)
+        return result
+
+
+class AsyncBotChucky:
+    """
+    Asyncio version of BotChucky, every send_* method is a coroutine,
+    so one event loop is able to keep thousands of sends in flight.
+
+    :Example:
+          async def handle(data):
+              async with AsyncBotChucky(token) as bot:
+                  await bot.send_message(get_sender_id(data), 'Hi!')
+    """
+    api_url = API_URL
+
+    def __init__(self, token, open_weather_token=None, soundcloud_id=None,
+                 transport=None):
+        """
+        :param token: Facebook Token, required
+        :param open_weather_token: not required
+        :param soundcloud_id: SoundCloud Access Token, not required
+        :param transport: Instance of AsyncTransport, not required
+        """
+        self.token = token
+        self.open_weather_token = open_weather_token
+        self.soundcloud_id = soundcloud_id
+        self.params = {'access_token': self.token}
+        self.headers = {'Content-Type': 'application/json'}
+        self.transport = transport or AsyncTransport()
+        self.fb = AsyncFacebookData(self.token, self.transport)
+        self.weather = AsyncWeatherData(open_weather_token, self.transport)
+        self.stack = AsyncStackExchangeData(self.transport)
+        self.soundcloud = AsyncSoundCloudData(soundcloud_id, self.transport)
+
+    async def _post(self, data, operation='send'):
+        """
+        :param data: Send API body, type -> dict
+        :param operation: Operation name used by metrics
+        :return: message text when Facebook rejected the message
+        """
+        status, text = await self.transport.post_json(
+            self.api_url, params=self.params, headers=self.headers,
+            json=data, upstream='graph', operation=operation
+        )
+        if status != 200:
+            return text
+
+    async def send_message(self, id_: str, text):
+        """
+        :param  id_: User facebook id, type -> str
+        :param text: some text, type -> str
+        """
+        return await self._post(text_payload(id_, text), 'send_message')
+
+    async def send_attachment(self, id_: str, attachment):
+        """
+        :param  id_: User facebook id, type -> str
+        :param attachment: Attach any image
+        """
+        return await self._post(image_payload(id_, attachment),
+                                'send_attachment')
+
+    async def send_action(self, id_: str, action='typing_on'):
+        """
+        :param id_: User facebook id, type -> str
+        :param action: 'typing_on', 'typing_off' or 'mark_seen'
+        """
+        return await self._post(action_payload(id_, action),
+                                'send_action')
+
+    async def send_weather_message(self, id_: str, city_name: str,
+                                   template=False, typing=False):
+        """
+        :param id_: User facebook id, type -> str
+        :param city_name: Find weather by city name
+        :param template: Send the description and the icon as one
+        generic template message instead of a text and an image
+        :param typing: Show the typing indicator while the weather
+        is fetched from Open Weather, never for a cached city,
+        default False, it costs one more Send API request
+        """
+        if self.open_weather_token is None:
+            raise BotChuckyTokenError('Open Weather')
+
+        fetch = self.weather.get_current_weather(city_name)
+        try:
+            if typing and not self.weather.is_cached(city_name):
+                _, weather_info = await asyncio.gather(
+                    self.send_action(id_), fetch)
+            else:
+                weather_info = await fetch
+        except BotChuckyUpstreamError:
+            return await self.send_message(id_, unavailable_reply('weather'))
+        msg, icon = weather_reply(weather_info, city_name)
+
+        if icon is None:
+            return await self.send_message(id_, msg)
+
+        if template:
+            return await self._post(card_payload(id_, msg.strip(), icon),
+                                    'send_template')
+
+        return (await self.send_message(id_, msg) or
+                await self.send_attachment(id_, icon))
+
+    async def send_soundcloud_message(self, id_: str, artist: str):
+        """
+        :param id_: User facebook id, type -> str
+        :param artist: artist to search for, type -> str
+        """
+        if not self.soundcloud_id:
+            raise BotChuckyTokenError('SoundCloud')
+        result = await self.soundcloud.search(artist)
+
+        if result['success']:
+            msg = soundcloud_reply(result['artists'], result['tracks'])
+            return await self.send_message(id_, msg)
+
+        msg = f'SoundCloud Error: {result["detail"]}'
+        return await self.send_message(id_, msg)
+
+    async def send_stack_questions(self, id_, **kwargs):
+        """
+        :param id_: a User id
+        :param kwargs: find by title='Update Django'
+                               tag='Django'
+        """
+        try:
+            answers = await self.stack.get_stack_answer_by(**kwargs)
+        except BotChuckyUpstreamError:
+            return await self.send_message(id_,
+                                           unavailable_reply('StackOverflow'))
+        return await self.send_message(id_, stack_reply(answers))
+
+    async def close(self):
+        """
+        Close pooled connections
+        """
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,159 @@
+""" Registry of reusable attachment ids """
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .transport import error_code
+
+# Graph API error code of an invalid parameter, such as an unknown,
+# expired or foreign attachment_id
+INVALID_PARAMETER_CODE = 100
+
+
+def attachment_rejected(response) -> bool:
+    """
+    :param response: requests.Response of a Send API request
+    :return: True when Facebook rejected the attachment itself,
+    not the recipient or the rate of messages
+    """
+    if error_code(response) != INVALID_PARAMETER_CODE:
+        return False
+    try:
+        message = response.json()['error'].get('message') or ''
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return 'attachment' in message.lower()
+
+
+class AttachmentRegistry:
+    """
+    Class which maps attachment urls to the attachment_id Facebook
+    returned when the url was uploaded with is_reusable, so an image
+    is uploaded once and later sent by id.
+    Only urls starting with one of `prefixes` are registered, other
+    images are sent by url. At most `maxsize` ids are kept, the least
+    recently used ones are forgotten first, and the file is rewritten
+    at most once every `save_interval` seconds and on exit.
+    Attachment ids belong to a page, use one registry per page token.
+
+    :Example:
+          registry = AttachmentRegistry(
+              'weather-icons.json',
+              prefixes=('http://openweathermap.org/img/',)
+          )
+          bot = BotChucky(token, attachments=registry)
+          bot.send_attachment(id_, 'http://openweathermap.org/img/w/01d.png')
+    """
+    def __init__(self, path=None, maxsize=256, prefixes=None,
+                 save_interval=30, timer=time.monotonic):
+        """
+        :param path: JSON file where ids are kept between restarts,
+        not required, ids are kept in memory only without it
+        :param maxsize: Max number of registered urls, type -> int
+        :param prefixes: Url prefixes worth registering, type -> tuple,
+                         default every url
+        :param save_interval: Min seconds between two writes of the file
+        :param timer: Clock function, default time.monotonic
+        """
+        if maxsize <= 0:
+            raise ValueError('maxsize must be a positive number')
+        self.path = path
+        self.maxsize = maxsize
+        self.prefixes = tuple(prefixes) if prefixes is not None else None
+        self.save_interval = save_interval
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._ids = self._load()
+        self._evict()
+        self._dirty = False
+        self._saved = timer()
+        if path is not None:
+            atexit.register(self.flush)
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return OrderedDict()
+        with open(self.path, encoding='utf-8') as f:
+            try:
+                ids = json.load(f)
+            except ValueError:
+                return OrderedDict()
+        return OrderedDict((url, attachment_id)
+                           for url, attachment_id in ids.items()
+                           if self.accepts(url))
+
+    def _save(self):
+        self._dirty = False
+        self._saved = self._timer()
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._ids, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _changed(self):
+        self._dirty = True
+        if self._timer() - self._saved >= self.save_interval:
+            self._save()
+
+    def _evict(self):
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def accepts(self, url) -> bool:
+        """
+        :param url: Attachment url, type -> str
+        :return: True when the url may be registered
+        """
+        return self.prefixes is None or url.startswith(self.prefixes)
+
+    def get(self, url):
+        """
+        :param url: Attachment url, type -> str
+        :return: attachment_id, None if the url was not uploaded yet
+        """
+        with self._lock:
+            attachment_id = self._ids.get(url)
+            if attachment_id is not None:
+                self._ids.move_to_end(url)
+            return attachment_id
+
+    def set(self, url, attachment_id):
+        """
+        :param url: Attachment url, type -> str
+        :param attachment_id: Id returned by the Attachment Upload API
+        """
+        if not self.accepts(url):
+            return
+        with self._lock:
+            self._ids[url] = attachment_id
+            self._ids.move_to_end(url)
+            self._evict()
+            self._changed()
+
+    def forget(self, url):
+        """
+        :param url: Attachment url, upload it again on the next send
+        """
+        with self._lock:
+            if self._ids.pop(url, None) is not None:
+                self._changed()
+
+    def flush(self):
+        """
+        Write the pending changes to the file
+        """
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, url):
+        return url in self._ids
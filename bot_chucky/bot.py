@@ -1,17 +1,30 @@
-import requests as r
+import json
+from concurrent.futures import ThreadPoolExecutor
 
-from .constants import API_URL
-from .errors import BotChuckyInvalidToken, BotChuckyTokenError
+from .attachments import attachment_rejected
+from .constants import (API_URL, ATTACHMENT_API_URL, GRAPH_BATCH_LIMIT,
+                        GRAPH_URL)
+from .errors import BotChuckyTokenError, BotChuckyUpstreamError
 from .helpers import (FacebookData, SoundCloudData,
                       StackExchangeData, TwitterData,
                       WeatherData)
+from .messages import (action_payload, batch_item, card_payload,
+                       image_payload, soundcloud_reply, stack_reply,
+                       text_payload, unavailable_reply, weather_reply)
+from .transport import get_default_transport
+from .utils import lazy_property
 
 
 class BotChucky:
+    # Endpoints, override them on an instance to talk to another server
+    api_url = API_URL
+    graph_url = GRAPH_URL
+    attachment_api_url = ATTACHMENT_API_URL
+
     def __init__(self, token, open_weather_token=None,
                  tw_consumer_key=None, tw_consumer_secret=None,
                  tw_access_token_key=None, tw_access_token_secret=None,
-                 soundcloud_id=None):
+                 soundcloud_id=None, transport=None, attachments=None):
         """
         :param token: Facebook Token, required
         :param open_weather_token: not required
@@ -30,63 +43,241 @@ class BotChucky:
         :param twitter: Instance of TwitterData class, default
         :param soundcloud_id: SoundCloud Access Token, not required
         :param stack: Instance of StackExchange class, not required
+        :param transport: Instance of Transport, pooled HTTP connections
+        shared by the bot and every helper, default shared one
+        :param attachments: Instance of AttachmentRegistry, images are
+        uploaded once and then sent by attachment id, not required
         """
         self.token = token
         self.open_weather_token = open_weather_token
         self.params = {'access_token': self.token}
         self.headers = {'Content-Type': 'application/json'}
-        self.fb = FacebookData(self.token)
-        self.weather = WeatherData(open_weather_token)
+        self.transport = transport or get_default_transport()
         self.twitter_tokens = {
             'consumer_key': tw_consumer_key,
             'consumer_secret': tw_consumer_secret,
             'access_token_key': tw_access_token_key,
             'access_token_secret': tw_access_token_secret
         }
-        self.twitter = TwitterData(self.twitter_tokens)
         self.soundcloud_id = soundcloud_id
-        self.soundcloud = SoundCloudData(self.soundcloud_id)
-        self.stack = StackExchangeData()
+        self.attachments = attachments
+
+    # Helper clients are built on first use, so a bot which only sends
+    # messages never imports the facebook, twitter or soundcloud SDKs.
+    @lazy_property
+    def fb(self):
+        return FacebookData(self.token, transport=self.transport)
+
+    @lazy_property
+    def weather(self):
+        return WeatherData(self.open_weather_token, transport=self.transport)
+
+    @lazy_property
+    def twitter(self):
+        return TwitterData(self.twitter_tokens, transport=self.transport)
+
+    @lazy_property
+    def soundcloud(self):
+        return SoundCloudData(self.soundcloud_id, transport=self.transport)
+
+    @lazy_property
+    def stack(self):
+        return StackExchangeData(transport=self.transport)
+
+    def breaker_states(self):
+        """
+        :return: dictionary {upstream: 'closed', 'open' or 'half_open'}
+        """
+        return self.transport.breaker_states()
+
+    def post_payload(self, data, operation='send'):
+        """
+        :param data: Send API body, type -> dict
+        :param operation: Operation name used by metrics
+        :return: requests.Response object
+        """
+        return self.transport.post(self.api_url, params=self.params,
+                                   headers=self.headers, json=data,
+                                   upstream='graph', operation=operation)
+
+    def _post(self, data, operation='send'):
+        """
+        :param data: Send API body, type -> dict
+        :param operation: Operation name used by metrics
+        :return: message.text when Facebook rejected the message
+        """
+        message = self.post_payload(data, operation)
+        if message.status_code != 200:
+            return message.text
 
     def send_message(self, id_: str, text):
         """
         :param  id_: User facebook id, type -> str
         :param text: some text, type -> str
         """
-        data = {
-            'recipient': {'id': id_},
-            'message': {'text': text}
-        }
-        message = r.post(API_URL, params=self.params,
-                         headers=self.headers, json=data)
-        if message.status_code is not 200:
-            return message.text
+        return self._post(text_payload(id_, text), 'send_message')
 
-    def send_attachment(self, id_: str,  attachment):
+    def _post_batch(self, payloads):
         """
-        :param  id_: User facebook id, type -> str
-        :param attachment: Attach any image
+        :param payloads: Up to GRAPH_BATCH_LIMIT Send API bodies
+        :return: a list with None for every delivered message,
+        or the error text Facebook returned for it
+        """
+        batch = json.dumps([batch_item(data) for data in payloads])
+        try:
+            message = self.transport.post(self.graph_url, params=self.params,
+                                          data={'batch': batch},
+                                          upstream='graph',
+                                          operation='batch')
+        except BotChuckyUpstreamError as exc:
+            # The other chunks go on, the caller sees who was not reached
+            return [str(exc)] * len(payloads)
+        if message.status_code != 200:
+            return [message.text] * len(payloads)
+
+        results = []
+        for reply in message.json():
+            if reply is None:
+                results.append('Batch operation timed out')
+            elif reply.get('code') != 200:
+                results.append(reply.get('body'))
+            else:
+                results.append(None)
+        return results
+
+    def send_messages_bulk(self, recipients, text_or_fn, max_workers=4):
+        """
+        Send a message to many users, packing up to GRAPH_BATCH_LIMIT
+        Send API calls into each Graph API batch request.
+
+        :param recipients: User facebook ids, type -> iterable of str
+        :param text_or_fn: some text, type -> str, or a function
+        which takes a user id and returns personalised text
+        :param max_workers: Batch requests sent at the same time
+        :return: a list aligned with recipients, None for every
+        delivered message or the error text for a failed one
+        """
+        recipients = list(recipients)
+        if callable(text_or_fn):
+            payloads = [text_payload(id_, text_or_fn(id_))
+                        for id_ in recipients]
+        else:
+            payloads = [text_payload(id_, text_or_fn) for id_ in recipients]
+
+        chunks = [payloads[i:i + GRAPH_BATCH_LIMIT]
+                  for i in range(0, len(payloads), GRAPH_BATCH_LIMIT)]
+        if not chunks:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            replies = pool.map(self._post_batch, chunks)
+            return [result for chunk in replies for result in chunk]
+
+    def upload_attachment(self, url):
+        """
+        Upload an image with is_reusable through the Attachment Upload API
+
+        :param url: Image url, type -> str
+        :return: attachment_id, None if the upload failed
         """
         data = {
-            'recipient': {'id': id_},
             'message': {
                 'attachment': {
                     'type': 'image',
-                    'payload': {
-                        'url': attachment
-                    }
+                    'payload': {'url': url, 'is_reusable': True}
                 }
             }
         }
-        message = r.post(API_URL, params=self.params,
-                         headers=self.headers, json=data)
-        if message.status_code is not 200:
-            return message.text
+        message = self.transport.post(self.attachment_api_url,
+                                      params=self.params,
+                                      headers=self.headers, json=data,
+                                      upstream='graph',
+                                      operation='upload_attachment')
+        if message.status_code != 200:
+            return None
+        attachment_id = message.json().get('attachment_id')
+        if attachment_id is not None and self.attachments is not None:
+            self.attachments.set(url, attachment_id)
+        return attachment_id
+
+    def attachment_payload(self, id_: str, attachment):
+        """
+        :param  id_: User facebook id, type -> str
+        :param attachment: Image url
+        :return: Send API body, which refers to the image by its
+        attachment_id when the bot has an AttachmentRegistry
+        which accepts the url
+        """
+        if self.attachments is None or \
+                not self.attachments.accepts(attachment):
+            return image_payload(id_, attachment)
+
+        attachment_id = self.attachments.get(attachment)
+        if attachment_id is None:
+            attachment_id = self.upload_attachment(attachment)
+        if attachment_id is None:
+            return image_payload(id_, attachment)
+        return image_payload(id_, attachment_id=attachment_id)
 
-    def send_weather_message(self, id_: str, city_name: str):
+    def attachment_fallback(self, id_: str, attachment, data, response):
+        """
+        :param  id_: User facebook id, type -> str
+        :param attachment: Image url
+        :param data: Send API body Facebook did not deliver
+        :param response: requests.Response of the Send API request
+        :return: Send API body with the image url when Facebook
+        rejected the attachment_id data referred to, which is
+        forgotten, None otherwise
+        """
+        payload = data['message']['attachment']['payload']
+        if 'attachment_id' not in payload or \
+                not attachment_rejected(response):
+            return None
+        if self.attachments is not None:
+            self.attachments.forget(attachment)
+        return image_payload(id_, attachment)
+
+    def send_attachment(self, id_: str,  attachment):
+        """
+        :param  id_: User facebook id, type -> str
+        :param attachment: Attach any image
+        """
+        data = self.attachment_payload(id_, attachment)
+        message = self.post_payload(data, 'send_attachment')
+        if message.status_code == 200:
+            return None
+        # An expired or rejected attachment_id, send the url instead
+        data = self.attachment_fallback(id_, attachment, data, message)
+        if data is not None:
+            return self._post(data, 'send_attachment')
+        return message.text
+
+    @lazy_property
+    def executor(self):
+        """
+        :return: Thread pool for calls which run alongside others,
+        as large as the connection pool of the transport
+        """
+        workers = getattr(self.transport, 'pool_maxsize', None) or 10
+        return ThreadPoolExecutor(max_workers=workers)
+
+    def send_action(self, id_: str, action='typing_on'):
+        """
+        :param id_: User facebook id, type -> str
+        :param action: 'typing_on', 'typing_off' or 'mark_seen'
+        """
+        return self._post(action_payload(id_, action), 'send_action')
+
+    def send_weather_message(self, id_: str, city_name: str,
+                             template=False, typing=False):
         """
         :param id_: User facebook id, type -> str
         :param city_name: Find weather by city name
+        :param template: Send the description and the icon as one
+        generic template message instead of a text and an image
+        :param typing: Show the typing indicator while the weather
+        is fetched from Open Weather, never for a cached city,
+        default False, it costs one more Send API request
         :return send_message function, send message to a user,
         with current weather
         """
@@ -94,26 +285,33 @@ class BotChucky:
         if self.open_weather_token is None:
             raise BotChuckyTokenError('Open Weather')
 
-        weather_info = self.weather.get_current_weather(city_name)
-        if weather_info['cod'] == 401:
-            error = weather_info['message']
-            raise BotChuckyInvalidToken(error)
+        indicator = None
+        if typing and not self.weather.is_cached(city_name):
+            indicator = self.executor.submit(self.send_action, id_)
+        try:
+            weather_info = self.weather.get_current_weather(city_name)
+        except BotChuckyUpstreamError:
+            weather_info = None
+        finally:
+            # An indicator still queued is dropped, one being sent
+            # must reach the user before the reply
+            if indicator is not None and not indicator.cancel():
+                indicator.exception()
 
-        if weather_info['cod'] == '404':
-            msg = f'Sorry I cant find information ' \
-                  f'about weather in {city_name}, '
+        if weather_info is None:
+            return self.send_message(id_, unavailable_reply('weather'))
+        msg, icon = weather_reply(weather_info, city_name)
 
+        if icon is None:
             return self.send_message(id_, msg)
 
-        description = weather_info['weather'][0]['description']
-
-        code = weather_info['weather'][0]['icon']
-        icon = f'http://openweathermap.org/img/w/{code}.png'
+        if template:
+            return self._post(card_payload(id_, msg.strip(), icon),
+                              'send_template')
 
-        msg = f'Current weather in {city_name} is: {description}\n'
-
-        self.send_message(id_, msg)
-        self.send_attachment(id_, icon)
+        # Both messages go over the same pooled connection,
+        # one after the other, so they arrive in order.
+        return self.send_message(id_, msg) or self.send_attachment(id_, icon)
 
     def send_tweet(self, status: str):
         """
@@ -140,9 +338,7 @@ class BotChucky:
         result = self.soundcloud.search(artist)
 
         if result['success']:
-            tracks_from_artist = list(result['tracks'].title)
-            msg = f'SoundCloud found {result["artists"]}, \n' \
-                  f'Track Listing: {tracks_from_artist}'
+            msg = soundcloud_reply(result['artists'], result['tracks'])
             return self.send_message(id_, msg)
 
         msg = f'SoundCloud Error: {result["detail"]}'
@@ -156,19 +352,8 @@ class BotChucky:
                                tag='Django'
         :return: send_message function, send message to a user with questions
         """
-        msg = 'I can\'t find questions for you;( try again'
-        answers = self.stack.get_stack_answer_by(**kwargs)
-
-        if answers:
-            if len(answers) > 2:
-                msg = f'I found questions for you, links below\n\n ' \
-                      f'Question 1: {answers[0]}\n' \
-                      f'Question 2: {answers[1]}'
-                return self.send_message(id_, msg)
-
-            if len(answers) == 1:
-                msg = f'I found question for you, link below\n\n ' \
-                      f'Question: {answers[0]}'
-                return self.send_message(id_, msg)
-        else:
-            return self.send_message(id_, msg)
+        try:
+            answers = self.stack.get_stack_answer_by(**kwargs)
+        except BotChuckyUpstreamError:
+            return self.send_message(id_, unavailable_reply('StackOverflow'))
+        return self.send_message(id_, stack_reply(answers))
@@ -0,0 +1,298 @@
+""" Cache backends used by the helper classes """
+
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class BaseCache:
+    """
+    Interface of a cache backend. Every helper class accepts a backend
+    through its `cache` argument, values must be JSON serializable
+    for backends which store them outside the process.
+    """
+    def get(self, key, default=None):
+        """
+        :return: Cached value or default when it is missing or expired
+        """
+        raise NotImplementedError
+
+    def get_stale(self, key, default=None):
+        """
+        :return: Cached value even if it expired, default when missing
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        :param ttl: Time-to-live of this entry, default the backend ttl
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    @property
+    def stats(self):
+        """
+        :return: hits, misses and size of the cache, type -> dict
+        """
+        raise NotImplementedError
+
+
+class TTLCache(BaseCache):
+    """
+    Thread-safe LRU cache with a bounded size where every entry expires
+    after its own time-to-live.
+
+    :Example:
+          cache = TTLCache(maxsize=256, ttl=600)
+          cache.set('kyiv', info)
+          cache.get('kyiv')  # info, until 600 seconds have passed
+    """
+    def __init__(self, maxsize=256, ttl=600, timer=time.monotonic):
+        """
+        :param maxsize: Max number of entries, least recently used
+        entries are evicted first, type -> int
+        :param ttl: Default time-to-live of an entry, seconds
+        :param timer: Clock function, default time.monotonic
+        """
+        if maxsize <= 0:
+            raise ValueError('maxsize must be a positive number')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        :param key: Cache key
+        :param default: Returned when the key is missing or expired
+        :return: Cached value or default
+        """
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is not MISSING:
+                expires, value = item
+                if expires > self._timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def get_stale(self, key, default=None):
+        """
+        :param key: Cache key
+        :param default: Returned when the key is missing
+        :return: Cached value even if it expired, expired entries are
+        kept until they are evicted, so they can serve as a fallback
+        """
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            return default if item is MISSING else item[1]
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key: Cache key
+        :param value: Value to store
+        :param ttl: Time-to-live of this entry, default self.ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (self._timer() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def stats(self):
+        """
+        :return: hits, misses and size of the cache, type -> dict
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+
+MemoryCache = TTLCache
+
+
+class SqliteCache(BaseCache):
+    """
+    LRU cache with a TTL per entry kept in a local SQLite file,
+    so several worker processes on one host share it and entries
+    survive restarts. Several caches can share a file,
+    each uses its own namespace.
+
+    :Example:
+          weather_cache = SqliteCache('/tmp/chucky.db', namespace='weather')
+          bot.weather = WeatherData(token, cache=weather_cache)
+    """
+    def __init__(self, path, namespace='default', maxsize=10000, ttl=600,
+                 timer=time.time):
+        """
+        :param path: SQLite file, created when it does not exist
+        :param namespace: Name which separates caches in one file
+        :param maxsize: Max number of entries in the namespace
+        :param ttl: Default time-to-live of an entry, seconds
+        :param timer: Clock function, it must be shared by every
+        process, default time.time
+        """
+        if maxsize <= 0:
+            raise ValueError('maxsize must be a positive number')
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._local = threading.local()
+        with _Transaction(self._db()) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                       'namespace TEXT, key TEXT, value TEXT, '
+                       'expires REAL, used REAL, '
+                       'PRIMARY KEY (namespace, key))')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_used '
+                       'ON cache (namespace, used)')
+
+    def _db(self):
+        """
+        :return: SQLite connection of the current thread and process
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None or getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, sort_keys=True)
+
+    def _row(self, key):
+        return self._db().execute(
+            'SELECT value, expires FROM cache '
+            'WHERE namespace = ? AND key = ?',
+            (self.namespace, self._key(key))
+        ).fetchone()
+
+    def get(self, key, default=None):
+        now = self._timer()
+        row = self._row(key)
+        if row is None or row[1] <= now:
+            self.misses += 1
+            return default
+        self._db().execute('UPDATE cache SET used = ? '
+                           'WHERE namespace = ? AND key = ?',
+                           (now, self.namespace, self._key(key)))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def get_stale(self, key, default=None):
+        row = self._row(key)
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = self._timer()
+        with _Transaction(self._db()) as db:
+            db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                       (self.namespace, self._key(key), json.dumps(value),
+                        now + ttl, now))
+            db.execute('DELETE FROM cache WHERE namespace = ? AND key IN ('
+                       'SELECT key FROM cache WHERE namespace = ? '
+                       'ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                       (self.namespace, self.namespace, self.maxsize))
+
+    def delete(self, key):
+        self._db().execute('DELETE FROM cache WHERE namespace = ? AND key = ?',
+                           (self.namespace, self._key(key)))
+
+    def clear(self):
+        self._db().execute('DELETE FROM cache WHERE namespace = ?',
+                           (self.namespace,))
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM cache '
+                                  'WHERE namespace = ?',
+                                  (self.namespace,)).fetchone()[0]
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self), 'maxsize': self.maxsize}
+
+
+class _Transaction:
+    """
+    Runs the statements of a `with` block in one immediate transaction
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def cached(cache, key=None, ttl=None):
+    """
+    Decorator which keeps the results of a function in a cache backend
+
+    :param cache: Cache backend, e.g. TTLCache or SqliteCache
+    :param key: Function which builds the cache key from the call
+    arguments, default the positional and keyword arguments
+    :param ttl: Time-to-live of the results, default the backend ttl
+
+    :Example:
+          @cached(SqliteCache('/tmp/chucky.db', namespace='jokes'))
+          def get_joke(topic):
+              ...
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if key is not None else \
+                [func.__qualname__, list(args), sorted(kwargs.items())]
+            cache_key = json.dumps(cache_key, sort_keys=True)
+            value = cache.get(cache_key, MISSING)
+            if value is MISSING:
+                value = func(*args, **kwargs)
+                cache.set(cache_key, value, ttl)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
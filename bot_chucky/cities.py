@@ -0,0 +1,256 @@
+"""
+Local index of the Open Weather city list
+
+Build it once from http://bulk.openweathermap.org/sample/city.list.json.gz:
+    python -m bot_chucky.cities city.list.json.gz cities.idx
+"""
+
+import argparse
+import difflib
+import gzip
+import json
+import mmap
+import struct
+import sys
+import unicodedata
+from collections import namedtuple
+
+City = namedtuple('City', 'id name country')
+
+_MAGIC = b'BCCITY01'
+# magic, number of cities, offset of the names
+_HEADER = struct.Struct('<8sII')
+# city id, offset of the strings, length of the normalized name,
+# length of the name (0 when it is the normalized one), country code
+_RECORD = struct.Struct('<IIBB2s')
+
+
+def normalize(name: str) -> str:
+    """
+    :param name: City name as typed by a user, type -> str
+    :return: Name without accents, case and extra spaces, type -> str
+    """
+    name = unicodedata.normalize('NFKD', ' '.join(name.split()))
+    return ''.join(c for c in name
+                   if not unicodedata.combining(c)).casefold()
+
+
+def build(cities, path):
+    """
+    :param cities: Iterable of Open Weather city list items,
+                   {'id': ..., 'name': ..., 'country': ...}
+    :param path: Index file to write
+    :return: Number of indexed cities
+    """
+    rows = sorted(
+        (normalize(city['name']), city['name'], city.get('country') or '',
+         int(city['id']))
+        for city in cities if city.get('name')
+    )
+    rows = [row for row in rows
+            if max(len(row[0].encode()), len(row[1].encode())) < 256]
+    names = bytearray()
+    records = bytearray()
+    for key, name, country, id_ in rows:
+        key_data = key.encode()
+        name_data = b'' if name == key else name.encode()
+        records += _RECORD.pack(id_, len(names), len(key_data),
+                                len(name_data),
+                                country.encode('ascii', 'replace')[:2])
+        names += key_data + name_data
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(rows),
+                             _HEADER.size + len(records)))
+        f.write(records)
+        f.write(names)
+    return len(rows)
+
+
+def load_city_list(path):
+    """
+    :param path: city.list.json or city.list.json.gz file
+    :return: list of city dictionaries
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CityIndex:
+    """
+    Memory-mapped index of city names sorted by their normalized form,
+    a record is 12 bytes followed by the names, pages are loaded by the
+    OS on demand, so every worker process shares one copy of the file.
+    Names are resolved to city ids without any network call.
+
+    :Example:
+          cities = CityIndex('cities.idx')
+          cities.resolve('Kyiv')        # City(id=703448, name='Kyiv', ...)
+          cities.resolve('Paris, FR')   # restricted to a country
+          cities.resolve('Kyyiv')       # closest name, typos are fine
+          cities.resolve('hello')       # None
+    """
+    def __init__(self, path):
+        """
+        :param path: Index file written by build()
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._names = _HEADER.unpack_from(self._data)
+        if magic != _MAGIC:
+            raise ValueError(f'{path} is not a city index')
+
+    @classmethod
+    def from_city_list(cls, source, path):
+        """
+        :param source: city.list.json or city.list.json.gz file
+        :param path: Index file to write
+        :return: CityIndex of the new file
+        """
+        build(load_city_list(source), path)
+        return cls(path)
+
+    def _record(self, i):
+        return _RECORD.unpack_from(self._data,
+                                   _HEADER.size + i * _RECORD.size)
+
+    def _city(self, i) -> City:
+        id_, offset, key_length, length, country = self._record(i)
+        start = self._names + offset
+        if length:
+            start += key_length
+        else:
+            length = key_length
+        name = self._data[start:start + length].decode()
+        return City(id_, name, country.rstrip(b'\0').decode())
+
+    def _key(self, i):
+        _, offset, length, _, _ = self._record(i)
+        start = self._names + offset
+        return self._data[start:start + length].decode()
+
+    def _bisect(self, key):
+        """
+        :return: Position of the first name not lower than key
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _range(self, prefix):
+        start = self._bisect(prefix)
+        end = self._bisect(prefix + '\U0010ffff')
+        return start, end
+
+    @staticmethod
+    def _split_country(query):
+        name, _, country = query.rpartition(',')
+        country = country.strip()
+        if name and len(country) == 2 and country.isalpha():
+            return name, country.upper()
+        return query, None
+
+    def exact(self, name, country=None):
+        """
+        :param name: City name, type -> str
+        :param country: Two letter country code, not required
+        :return: list of City with exactly this name
+        """
+        key = normalize(name)
+        cities = []
+        for i in range(self._bisect(key), self._count):
+            if self._key(i) != key:
+                break
+            city = self._city(i)
+            if country is None or city.country == country:
+                cities.append(city)
+        return cities
+
+    def prefix(self, prefix, limit=10):
+        """
+        :param prefix: Beginning of a city name, type -> str
+        :param limit: Max number of results
+        :return: list of City whose name starts with prefix
+        """
+        start, end = self._range(normalize(prefix))
+        return [self._city(i) for i in range(start, min(end, start + limit))]
+
+    def fuzzy(self, name, limit=5, cutoff=0.8, country=None):
+        """
+        :param name: City name, possibly misspelt, type -> str
+        :param limit: Max number of results
+        :param cutoff: Min similarity, between 0 and 1
+        :param country: Two letter country code, not required
+        :return: list of City, the closest names first.
+        Only names which start with the same letter and have about
+        the same length are compared.
+        """
+        key = normalize(name)
+        if not key:
+            return []
+        matcher = difflib.SequenceMatcher(b=key)
+        start, end = self._range(key[0])
+        scored = []
+        for i in range(start, end):
+            candidate = self._key(i)
+            if abs(len(candidate) - len(key)) > 2:
+                continue
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < cutoff or \
+                    matcher.quick_ratio() < cutoff:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= cutoff:
+                city = self._city(i)
+                if country is None or city.country == country:
+                    scored.append((-ratio, i, city))
+        scored.sort()
+        return [city for _, _, city in scored[:limit]]
+
+    def resolve(self, query, cutoff=0.8):
+        """
+        :param query: 'City' or 'City, CC' as typed by a user
+        :param cutoff: Min similarity of a misspelt name
+        :return: City, None when nothing is close enough
+        """
+        name, country = self._split_country(query)
+        cities = self.exact(name, country) or \
+            self.fuzzy(name, limit=1, cutoff=cutoff, country=country)
+        return cities[0] if cities else None
+
+    def __contains__(self, name):
+        return bool(self.exact(*self._split_country(name)))
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build a city index from the Open Weather city list'
+    )
+    parser.add_argument('source', help='city.list.json or city.list.json.gz')
+    parser.add_argument('path', help='index file to write')
+    args = parser.parse_args(argv)
+    count = build(load_city_list(args.source), args.path)
+    print(f'Indexed {count} cities into {args.path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
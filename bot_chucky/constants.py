@@ -1,3 +1,16 @@
 """ Constants file """
 
-API_URL = 'https://graph.facebook.com/v2.9/me/messages'
+GRAPH_URL = 'https://graph.facebook.com/v2.9'
+API_URL = f'{GRAPH_URL}/me/messages'
+ATTACHMENT_API_URL = f'{GRAPH_URL}/me/message_attachments'
+GRAPH_BATCH_LIMIT = 50
+GRAPH_IDS_LIMIT = 50
+MESSAGE_TEXT_LIMIT = 2000
+
+WEATHER_API_URL = 'http://api.openweathermap.org/data/2.5/weather'
+WEATHER_GROUP_LIMIT = 20
+WEATHER_ICON_URL = 'http://openweathermap.org/img/w/{0}.png'
+
+STACK_API_URL = 'https://api.stackexchange.com/2.2/search/advanced'
+
+SOUNDCLOUD_API_URL = 'https://api.soundcloud.com'
@@ -0,0 +1,199 @@
+""" Deduplication of redelivered webhook events """
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+def event_key(event) -> str:
+    """
+    :param event: MessageEvent object
+    :return: Message id, or sender, timestamp and type for events
+    without one (postbacks, deliveries, reads)
+    """
+    if event.mid:
+        return event.mid
+    return f'{event.sender}:{event.timestamp}:{event.type}'
+
+
+class WindowDeduplicator:
+    """
+    Class which remembers event keys for `window` seconds in a bounded
+    LRU, lookups and inserts are O(1) and memory is capped by maxsize.
+    """
+    def __init__(self, maxsize=100000, window=600, timer=time.monotonic):
+        """
+        :param maxsize: Max number of remembered keys, type -> int
+        :param window: Seconds a key is remembered, default 600
+        :param timer: Clock function, default time.monotonic
+        """
+        self.maxsize = maxsize
+        self.window = window
+        self._timer = timer
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._keys:
+            key, added = next(iter(self._keys.items()))
+            if now - added < self.window and len(self._keys) <= self.maxsize:
+                break
+            self._keys.popitem(last=False)
+
+    def contains(self, key) -> bool:
+        """
+        :param key: Event key, type -> str
+        :return: True if the key was added within the window
+        """
+        with self._lock:
+            added = self._keys.get(key)
+            return added is not None and self._timer() - added < self.window
+
+    def add(self, key):
+        """
+        :param key: Event key, type -> str
+        """
+        with self._lock:
+            now = self._timer()
+            self._keys[key] = now
+            self._keys.move_to_end(key)
+            self._expire(now)
+
+    def add_if_absent(self, key) -> bool:
+        """
+        Check and add a key under one lock, so concurrent deliveries
+        of one event cannot both be taken for new ones
+
+        :param key: Event key, type -> str
+        :return: True if the key was added, False for a duplicate
+        """
+        with self._lock:
+            now = self._timer()
+            added = self._keys.get(key)
+            if added is not None and now - added < self.window:
+                return False
+            self._keys[key] = now
+            self._keys.move_to_end(key)
+            self._expire(now)
+            return True
+
+    def discard(self, key):
+        """
+        :param key: Event key, forget it so it is handled when it
+                    is delivered again
+        """
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class BloomDeduplicator:
+    """
+    Class which remembers event keys in two rotating Bloom filters,
+    so memory is fixed whatever the traffic. A key is remembered for
+    at least `window` and at most 2 * `window` seconds. False positives,
+    a new event taken for a duplicate, happen at about error_rate.
+    """
+    def __init__(self, capacity=1000000, error_rate=0.001, window=600,
+                 timer=time.monotonic):
+        """
+        :param capacity: Expected number of keys per window, type -> int
+        :param error_rate: Acceptable false positive rate
+        :param window: Seconds between filter rotations, default 600
+        :param timer: Clock function, default time.monotonic
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.window = window
+        self._timer = timer
+        self._current = bytearray((self.size + 7) // 8)
+        self._previous = bytearray((self.size + 7) // 8)
+        self._rotated = timer()
+        # Discarded keys, their bits are set but they count as absent
+        self._discarded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    @staticmethod
+    def _has(bits, positions):
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def _rotate(self):
+        now = self._timer()
+        if now - self._rotated >= self.window:
+            if now - self._rotated >= 2 * self.window:
+                self._previous = bytearray(len(self._current))
+            else:
+                self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._rotated = now
+
+    def contains(self, key) -> bool:
+        """
+        :param key: Event key, type -> str
+        :return: True if the key was probably added within the window
+        """
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            return self._contains(key, positions)
+
+    def _contains(self, key, positions):
+        if key in self._discarded:
+            return False
+        return self._has(self._current, positions) or \
+            self._has(self._previous, positions)
+
+    def _add(self, key, positions):
+        self._discarded.pop(key, None)
+        for p in positions:
+            self._current[p >> 3] |= 1 << (p & 7)
+
+    def add(self, key):
+        """
+        :param key: Event key, type -> str
+        """
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            self._add(key, positions)
+
+    def add_if_absent(self, key) -> bool:
+        """
+        Check and add a key under one lock, so concurrent deliveries
+        of one event cannot both be taken for new ones
+
+        :param key: Event key, type -> str
+        :return: True if the key was added, False for a probable duplicate
+        """
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            if self._contains(key, positions):
+                return False
+            self._add(key, positions)
+            return True
+
+    def discard(self, key, maxsize=10000):
+        """
+        Bits of a Bloom filter cannot be cleared, the key is kept in a
+        small list of keys which count as absent until added again
+
+        :param key: Event key, forget it so it is handled when it
+                    is delivered again
+        :param maxsize: Max number of discarded keys kept
+        """
+        with self._lock:
+            self._discarded[key] = None
+            while len(self._discarded) > maxsize:
+                self._discarded.popitem(last=False)
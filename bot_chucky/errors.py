@@ -23,3 +23,22 @@ class BotChuckyError(Exception):
 
     def __str__(self):
         return self.msg
+
+
+class BotChuckyUpstreamError(BotChuckyError):
+    def __init__(self, upstream, msg):
+        """
+        :param upstream: Name of the failed upstream, e.g. 'openweather'
+        :param msg: Error message
+        """
+        self.upstream = upstream
+        super().__init__(msg)
+
+
+class BotChuckyCircuitOpen(BotChuckyUpstreamError):
+    def __init__(self, upstream):
+        """
+        :param upstream: Name of the unhealthy upstream
+        """
+        super().__init__(upstream, f'{upstream} is unavailable, '
+                                   f'its circuit breaker is open')
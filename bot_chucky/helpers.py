@@ -1,25 +1,52 @@
 """ Helper classes """
 
-from collections import Callable
-from urllib import parse
+import inspect
+import logging
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 
-import facebook
-import requests as r
-import soundcloud
-import twitter
+from bot_chucky.cache import TTLCache
+from bot_chucky.constants import (GRAPH_IDS_LIMIT, STACK_API_URL,
+                                  WEATHER_API_URL, WEATHER_GROUP_LIMIT)
+from bot_chucky.errors import BotChuckyError, BotChuckyUpstreamError
+from bot_chucky.transport import UPSTREAM_FAILURES, get_default_transport
+from bot_chucky.utils import lazy_property, split_text
 
-from bot_chucky.errors import BotChuckyError
-from bot_chucky.utils import split_text
+logger = logging.getLogger(__name__)
 
 
 class FacebookData:
-    def __init__(self, token):
+    def __init__(self, token, transport=None, cache_size=10000,
+                 cache_ttl=3600, cache=None):
         """
         :param token: Facebook Page token
+        :param transport: Instance of Transport, default shared one
+        :param cache_size: Max number of user names kept in the cache
+        :param cache_ttl: Seconds a user name is reused, default 3600
+        :param cache: Cache backend, e.g. SqliteCache,
+                      default a TTLCache of cache_size and cache_ttl
         :param _api: Instance of the GraphAPI object
         """
         self.token = token
-        self._api = facebook.GraphAPI(self.token)
+        self.transport = transport or get_default_transport()
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+
+    @lazy_property
+    def _api(self):
+        import facebook
+        return facebook.GraphAPI(self.token,
+                                 timeout=self.transport.timeout,
+                                 session=self.transport.session)
+
+    def _call(self, operation, func, *args, **kwargs):
+        import facebook
+        return self.transport.call('graph', operation, func, *args,
+                                   ignore=(facebook.GraphAPIError,),
+                                   **kwargs)
 
     def get_user_name(self, _id):
         """
@@ -28,19 +55,116 @@ class FacebookData:
         """
         if not isinstance(_id, str):
             raise ValueError('id must be a str')
-        user = self._api.get_object(_id)
-        return user['first_name'] if user else None
+        name = self.cache.get(_id)
+        if name is None:
+            user = self._call('get_user_name', self._api.get_object, _id,
+                              fields='first_name')
+            name = user.get('first_name') if user else None
+            if name is not None:
+                self.cache.set(_id, name)
+        return name
+
+    def get_user_names(self, ids):
+        """
+        Resolve many users with one Graph API ?ids= request
+        per GRAPH_IDS_LIMIT users, cached names are not requested again.
+        A request Facebook rejects because of an invalid id is retried
+        id by id, so only the invalid ids get None.
+
+        :param ids: User facebook ids, type -> iterable of str
+        :return: dictionary {id: first name or None}
+        """
+        names = {}
+        missing = []
+        for _id in ids:
+            if not isinstance(_id, str):
+                raise ValueError('id must be a str')
+            name = self.cache.get(_id)
+            if name is None:
+                missing.append(_id)
+            names[_id] = name
+
+        import facebook
+
+        missing = list(dict.fromkeys(missing))
+        for i in range(0, len(missing), GRAPH_IDS_LIMIT):
+            chunk = missing[i:i + GRAPH_IDS_LIMIT]
+            try:
+                users = self._call('get_user_names', self._api.get_objects,
+                                   chunk, fields='first_name')
+            except facebook.GraphAPIError:
+                # One invalid id fails the whole request,
+                # ask for the users of this chunk one by one
+                users = self._get_users(chunk)
+            for _id in chunk:
+                name = (users.get(_id) or {}).get('first_name')
+                names[_id] = name
+                if name is not None:
+                    self.cache.set(_id, name)
+        return names
+
+    def _get_users(self, ids):
+        """
+        :param ids: User facebook ids, type -> list
+        :return: dictionary {id: user object}, without the ids
+        Facebook rejected
+        """
+        import facebook
+
+        users = {}
+        for _id in ids:
+            try:
+                users[_id] = self._call('get_user_name', self._api.get_object,
+                                        _id, fields='first_name')
+            except facebook.GraphAPIError:
+                continue
+        return users
 
 
 class WeatherData:
     """
     Class which collect weather data
     """
-    def __init__(self, api_token):
+    api_url = WEATHER_API_URL
+
+    # Reply of Open Weather for an unknown city
+    NOT_FOUND = {'cod': '404', 'message': 'city not found'}
+
+    def __init__(self, api_token, transport=None, cache_size=256,
+                 cache_ttl=600, not_found_ttl=60, cache=None, cities=None):
         """
         :param api_token: Open Weather TOKEN
+        :param transport: Instance of Transport, default shared one
+        :param cache_size: Max number of cities kept in the cache
+        :param cache_ttl: Seconds a weather report is reused, default 600
+        :param not_found_ttl: Seconds an unknown city is remembered
+        :param cache: Cache backend, e.g. SqliteCache,
+                      default a TTLCache of cache_size and cache_ttl
+        :param cities: Instance of CityIndex, names are then resolved
+                       locally and cities are queried by id, not required
         """
         self.token = api_token
+        self.transport = transport or get_default_transport()
+        self.not_found_ttl = not_found_ttl
+        self.cities = cities
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+
+    @property
+    def group_url(self):
+        """
+        :return: url of the endpoint which reports several cities by id
+        """
+        return f'{self.api_url.rsplit("/", 1)[0]}/group'
+
+    @staticmethod
+    def normalize_city(city_name):
+        """
+        :param city_name: City name as typed by a user, type -> str
+        :return: Cache key, type -> str
+        """
+        return ' '.join(city_name.split()).casefold()
 
     def get_current_weather(self, city_name):
         """
@@ -51,37 +175,180 @@ class WeatherData:
 
         {'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky'}]}
         """
-        api_url = 'http://api.openweathermap.org' \
-            '/data/2.5/weather?q={0}&APPID={1}'.format(city_name, self.token)
-
-        info = r.get(api_url).json()
+        if self.cities is not None:
+            city_id = self.resolve_city(city_name)
+            if city_id is None:
+                return dict(self.NOT_FOUND)
+            return self.get_weather_by_ids([city_id])[city_id]
+
+        key = self.normalize_city(city_name)
+        info = self.cache.get(key)
+        if info is not None:
+            return info
+
+        params = {'q': city_name, 'APPID': self.token}
+        try:
+            info = self._get(self.api_url, params, 'current_weather')
+        except BotChuckyUpstreamError:
+            # Serve the last known weather while Open Weather is down
+            info = self.cache.get_stale(key)
+            if info is None:
+                raise
+            return info
+
+        if str(info.get('cod')) == '200':
+            self.cache.set(key, info)
+        elif str(info.get('cod')) == '404':
+            self.cache.set(key, info, ttl=self.not_found_ttl)
         return info
 
+    def is_cached(self, city_name) -> bool:
+        """
+        :param city_name: City name as typed by a user, type -> str
+        :return: True when get_current_weather answers from the cache
+        """
+        if self.cities is None:
+            return self.cache.get(self.normalize_city(city_name)) is not None
+        resolved = self.cache.get(f'city:{self.normalize_city(city_name)}')
+        if resolved is None:
+            return False
+        return resolved['id'] is None or \
+            self.cache.get(f'#{resolved["id"]}') is not None
+
+    def resolve_city(self, city_name):
+        """
+        :param city_name: City name as typed by a user, type -> str
+        :return: Open Weather city id, None for an unknown city.
+        Results are cached, unknown names for not_found_ttl, so a
+        message which is not a city is scanned by the index only once.
+        """
+        key = f'city:{self.normalize_city(city_name)}'
+        resolved = self.cache.get(key)
+        if resolved is not None:
+            return resolved['id']
+
+        city = self.cities.resolve(city_name)
+        if city is None:
+            self.cache.set(key, {'id': None}, ttl=self.not_found_ttl)
+            return None
+        self.cache.set(key, {'id': city.id})
+        return city.id
+
+    def _get(self, url, params, operation):
+        """
+        :return: Open Weather response, type -> dict
+        """
+        response = self.transport.get(url, params=params,
+                                      upstream='openweather',
+                                      operation=operation)
+        if response.status_code in UPSTREAM_FAILURES:
+            raise BotChuckyUpstreamError(
+                'openweather', f'Open Weather answered '
+                               f'{response.status_code}')
+        return response.json()
+
+    def get_weather_by_ids(self, ids):
+        """
+        :param ids: Open Weather city ids, type -> list
+        :return: dictionary {city id: weather info}, the cities which
+        are not cached are fetched WEATHER_GROUP_LIMIT per request
+        """
+        result = {}
+        missing = []
+        for id_ in dict.fromkeys(ids):
+            info = self.cache.get(f'#{id_}')
+            if info is not None:
+                result[id_] = info
+            else:
+                missing.append(id_)
+
+        for start in range(0, len(missing), WEATHER_GROUP_LIMIT):
+            chunk = missing[start:start + WEATHER_GROUP_LIMIT]
+            params = {'id': ','.join(map(str, chunk)), 'APPID': self.token}
+            try:
+                reply = self._get(self.group_url, params, 'group_weather')
+            except BotChuckyUpstreamError:
+                # Serve the last known weather while Open Weather is down
+                stale = {id_: self.cache.get_stale(f'#{id_}')
+                         for id_ in chunk}
+                if None in stale.values():
+                    raise
+                result.update(stale)
+                continue
+            if str(reply.get('cod', 200)) == '401':
+                reply['cod'] = 401
+                return {id_: reply for id_ in ids}
+            for info in reply.get('list', ()):
+                info.setdefault('cod', 200)
+                self.cache.set(f'#{info["id"]}', info)
+                result[info['id']] = info
+            for id_ in chunk:
+                result.setdefault(id_, dict(self.NOT_FOUND))
+        return result
+
+    def get_current_weather_many(self, city_names):
+        """
+        :param city_names: City names as typed by users, type -> list
+        :return: a list of weather info aligned with city_names.
+        With a CityIndex the known cities are fetched through the
+        group endpoint, without one each city is fetched on its own.
+        """
+        if self.cities is None:
+            return [self.get_current_weather(name) for name in city_names]
+
+        ids = [self.resolve_city(name) for name in city_names]
+        reports = self.get_weather_by_ids(
+            [id_ for id_ in ids if id_ is not None]
+        )
+        return [reports[id_] if id_ is not None
+                else dict(self.NOT_FOUND) for id_ in ids]
+
+    @property
+    def cache_stats(self):
+        """
+        :return: hits, misses and size of the weather cache, type -> dict
+        """
+        return self.cache.stats
+
 
 class TwitterData:
     """
     Class which collect Twitter data
     """
-    def __init__(self, tokens):
+    def __init__(self, tokens, transport=None):
         """
         :param tokens: Dictionary of all tokens
                        [consumer_key, consumer_secret, access_token_key,
                        access_token_secret]
                        required to initialize the Twitter Api
+        :param transport: Instance of Transport, its circuit breakers
+                          guard the calls, default shared one
         """
-        self.api = twitter.Api(
-            consumer_key=tokens['consumer_key'],
-            consumer_secret=tokens['consumer_secret'],
-            access_token_key=tokens['access_token_key'],
-            access_token_secret=tokens['access_token_secret']
+        self.tokens = tokens
+        self.transport = transport or get_default_transport()
+
+    @lazy_property
+    def api(self):
+        import twitter
+        return twitter.Api(
+            consumer_key=self.tokens['consumer_key'],
+            consumer_secret=self.tokens['consumer_secret'],
+            access_token_key=self.tokens['access_token_key'],
+            access_token_secret=self.tokens['access_token_secret']
         )
 
     def send_tweet(self, status):
+        import twitter
+
         if status:
             try:
+                tweet = self.transport.call(
+                    'twitter', 'send_tweet', self.api.PostUpdate, status,
+                    idempotent=False, ignore=(twitter.error.TwitterError,)
+                )
                 return {
                     'success': True,
-                    'tweet': self.api.PostUpdate(status)
+                    'tweet': tweet
                 }
             except twitter.error.TwitterError as TWE:
                 return {
@@ -90,55 +357,271 @@ class TwitterData:
                 }
 
 
+class StackQuota:
+    """
+    Class which tracks the StackExchange quota and backoff of a process.
+    A reply with `backoff` forbids calls for that many seconds, and an
+    exhausted quota forbids them until it resets at midnight UTC.
+    """
+    THROTTLE_ERROR_ID = 502
+
+    def __init__(self, timer=time.time):
+        """
+        :param timer: Clock function, default time.time
+        """
+        self.quota_remaining = None
+        self.quota_max = None
+        self.blocked_until = 0
+        self._timer = timer
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        :raise BotChuckyUpstreamError: while calls are not allowed
+        """
+        wait = self.blocked_until - self._timer()
+        if wait > 0:
+            raise BotChuckyUpstreamError(
+                'stackexchange', f'StackExchange asked to wait '
+                                 f'{wait:.0f} more seconds')
+
+    def block(self, seconds):
+        """
+        :param seconds: Seconds no call is allowed
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until,
+                                     self._timer() + seconds)
+
+    def update(self, reply):
+        """
+        :param reply: StackExchange response, type -> dict
+        """
+        if 'quota_remaining' in reply:
+            self.quota_remaining = reply['quota_remaining']
+            self.quota_max = reply.get('quota_max', self.quota_max)
+        if reply.get('backoff'):
+            self.block(reply['backoff'])
+        if reply.get('error_id') == self.THROTTLE_ERROR_ID:
+            self.block(60)
+        if self.quota_remaining == 0:
+            now = self._timer()
+            self.block((now // 86400 + 1) * 86400 - now)
+
+
 class StackExchangeData:
     """
-    Class which collect StackExchange data
+    Class which collect StackExchange data.
+    Identical queries running at the same time share one request,
+    and the backoff and quota StackExchange reports are honoured by
+    every instance of the process.
     """
     _default_parameters = {
         'order': 'desc',
         'sort': 'activity',
         'site': 'stackoverflow',
     }
+    # Fields kept by the filter requested with every search
+    _filter_fields = '.items;.backoff;.quota_remaining;.quota_max;' \
+                     '.error_id;question.link'
+    api_url = STACK_API_URL
+    quota = StackQuota()
+
+    def __init__(self, transport=None, cache_size=512, cache_ttl=300,
+                 cache=None, pagesize=2, filter=None):
+        """
+        :param transport: Instance of Transport, default shared one
+        :param cache_size: Max number of queries kept in the cache
+        :param cache_ttl: Seconds a list of links is reused, default 300
+        :param cache: Cache backend, e.g. SqliteCache,
+                      default a TTLCache of cache_size and cache_ttl
+        :param pagesize: Number of questions requested, default 2,
+                         the most send_stack_questions shows
+        :param filter: StackExchange filter, default one created on
+                       first use which keeps only the question links
+        """
+        self.transport = transport or get_default_transport()
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+        self.pagesize = pagesize
+        self.filter = filter
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._filter_lock = threading.Lock()
 
-    def get_stack_answer_by(self, **kwargs):
-            """
-            :param kwargs: create a query by arguments
-                           for example:
-                                tag='Python', will be search by tag
-                                title='Update Python', will be search by title
-                                and etc.
-            :return: an array with links
-            """
-            if len(kwargs) > 1:
-                raise BotChuckyError('The argument must be one')
-
-            for key in kwargs.keys():
-                query = kwargs.get(key)
-                self._default_parameters.update({key: query})
-
-                if not isinstance(query, str):
-                    raise TypeError(f'{query} must be a string')
-
-            encode_query = parse.urlencode(self._default_parameters)
-
-            stack_url = f'https://api.stackexchange.com/2.2/search/advanced?' \
-                        f'{encode_query}'
-
-            questions = r.get(stack_url).json()
-            links = [obj['link'] for obj in questions['items']]
+    @property
+    def filter_url(self):
+        """
+        :return: url of the endpoint which creates filters
+        """
+        return f'{self.api_url.rsplit("/search", 1)[0]}/filters/create'
+
+    def get_filter(self):
+        """
+        :return: Name of a filter with only the fields the bot reads,
+        'default' when it could not be created. It is created once,
+        threads which ask meanwhile wait for it.
+        """
+        if self.filter is None:
+            with self._filter_lock:
+                if self.filter is None:
+                    self.filter = self._create_filter()
+        return self.filter
+
+    def _create_filter(self):
+        params = {'include': self._filter_fields, 'base': 'none',
+                  'unsafe': 'false'}
+        try:
+            response = self.transport.get(self.filter_url, params=params,
+                                          upstream='stackexchange',
+                                          operation='create_filter')
+            return response.json()['items'][0]['filter']
+        except (BotChuckyUpstreamError, ValueError, KeyError, IndexError):
+            logger.warning('Could not create a StackExchange filter, '
+                           'using the default one')
+            return 'default'
+
+    def build_query(self, **kwargs):
+        """
+        :param kwargs: create a query by arguments, title='Update Python'
+        :return: a new dict with query parameters, the class defaults
+        are never modified, so the method is safe to call from threads
+        """
+        if len(kwargs) > 1:
+            raise BotChuckyError('The argument must be one')
+
+        params = dict(self._default_parameters)
+        for key, query in kwargs.items():
+            if not isinstance(query, str):
+                raise TypeError(f'{query} must be a string')
+            params[key] = query
+        return params
+
+    @staticmethod
+    def cache_key(params):
+        """
+        :param params: Query parameters, type -> dict
+        :return: Hashable key, queries which differ only in case or
+        spacing share one entry
+        """
+        return tuple(sorted(
+            (key, ' '.join(value.split()).casefold())
+            for key, value in params.items()
+        ))
+
+    def _search(self, params):
+        """
+        :param params: Query parameters, type -> dict
+        :return: an array with links
+        """
+        self.quota.check()
+        params = dict(params, pagesize=str(self.pagesize),
+                      filter=self.get_filter())
+        response = self.transport.get(self.api_url, params=params,
+                                      upstream='stackexchange',
+                                      operation='search')
+        if response.status_code in UPSTREAM_FAILURES:
+            raise BotChuckyUpstreamError(
+                'stackexchange', f'StackExchange answered '
+                                 f'{response.status_code}')
+        reply = response.json()
+        self.quota.update(reply)
+        if 'error_id' in reply:
+            raise BotChuckyUpstreamError(
+                'stackexchange', f'StackExchange answered '
+                                 f'{reply.get("error_name")}')
+        return [obj['link'] for obj in reply.get('items', ())]
+
+    def _shared_search(self, key, params):
+        """
+        :return: Result of _search, only the first of several threads
+        asking for the same key calls it, the others wait for its result
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            return flight.result()
+
+        try:
+            links = self._search(params)
+        except BaseException as exc:
+            flight.set_exception(exc)
+            raise
+        else:
+            flight.set_result(links)
             return links
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def get_stack_answer_by(self, **kwargs):
+        """
+        :param kwargs: create a query by arguments
+                       for example:
+                            tag='Python', will be search by tag
+                            title='Update Python', will be search by title
+                            and etc.
+        :return: an array with links
+        """
+        params = self.build_query(**kwargs)
+        key = self.cache_key(params)
+
+        links = self.cache.get(key)
+        if links is None:
+            try:
+                links = self._shared_search(key, params)
+            except BotChuckyUpstreamError:
+                # Serve the last known links while StackExchange is down
+                links = self.cache.get_stale(key)
+                if links is None:
+                    raise
+                return list(links)
+            self.cache.set(key, links)
+        return list(links)
+
+    @property
+    def cache_stats(self):
+        """
+        :return: hits, misses and size of the query cache, type -> dict
+        """
+        return self.cache.stats
 
 
 class SoundCloudData:
     """
     Class to gather soundcloud data, tracks etc
     """
-    def __init__(self, client_id):
+    def __init__(self, client_id, limit=10, cache_size=256, cache_ttl=600,
+                 transport=None, cache=None):
         """
         client_id = Client ID, must be registered
+        limit = Max artists and tracks requested per search
+        cache_size = Max number of searches kept in the cache
+        cache_ttl = Seconds a search result is reused, default 600
+        transport = Instance of Transport, its circuit breakers and
+                    retries guard the calls, default shared one
+        cache = Cache backend, e.g. SqliteCache,
+                default a TTLCache of cache_size and cache_ttl
         """
         self.client_id = client_id
-        self._api = soundcloud.Client(client_id=self.client_id)
+        self.transport = transport or get_default_transport()
+        self.limit = limit
+        if cache is None:
+            cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.cache = cache
+
+    @lazy_property
+    def executor(self):
+        return ThreadPoolExecutor(max_workers=4)
+
+    @lazy_property
+    def _api(self):
+        import soundcloud
+        return soundcloud.Client(client_id=self.client_id)
 
     def resolve_track(self, url):
         """
@@ -146,11 +629,13 @@ class SoundCloudData:
         :param url: permalink to a track (str)
         """
         try:
-            track = self._api.get('/resolve', str(url))
+            resolved = self.transport.call('soundcloud', 'resolve',
+                                           self._api.get, '/resolve',
+                                           str(url))
 
             return {
                 'success': True,
-                'track': track.id
+                'track': resolved.id
             }
         except Exception as error:
             return {
@@ -158,28 +643,56 @@ class SoundCloudData:
                 'detail': f'Error: {error.message}, Code: {error.response.status_code}'
             }
 
-    def search(self, artist=None):
+    def _get(self, path, operation, **params):
+        return self.transport.call('soundcloud', operation,
+                                   self._api.get, path, **params)
+
+    @staticmethod
+    def cache_key(artist, limit):
+        """
+        :param artist: Artist as typed by a user, type -> str
+        :param limit: Max artists and tracks requested, type -> int
+        :return: Cache key, searches which differ only in case or
+        spacing share one entry
+        """
+        return ' '.join(artist.split()).casefold(), limit
+
+    def search(self, artist=None, limit=None):
         """
         Search for tracks by artist, or artist by track
         :param artist: search by artist, returns tracks and info, type -> str
+        :param limit: Max artists and tracks requested, default self.limit
+        :return: dictionary {'success': True, 'artists': [usernames],
+                             'tracks': [titles]}
         """
         self.artist = artist
 
         if self.artist is not None:
+            limit = limit or self.limit
+            key = self.cache_key(artist, limit)
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
             try:
-                artists = self._api.get('/users', q=self.artist)
-                tracks = self._api.get('/tracks', q=self.artist)
-                return {
+                # Both lookups run at the same time
+                users = self.executor.submit(self._get, '/users', 'users',
+                                             q=artist, limit=limit)
+                tracks = self._get('/tracks', 'tracks', q=artist, limit=limit)
+                result = {
                     'success': True,
-                    'artists': artists,
-                    'tracks': tracks
+                    'artists': [user.username for user in users.result()],
+                    'tracks': [item.title for item in tracks]
                 }
             except Exception as error:
+                response = getattr(error, 'response', None)
                 return {
                     'success': False,
-                    'detail': f'Error: {error.message}, Code: '
-                              f'{error.response.status_code}'
+                    'detail': f'Error: {error}, Code: '
+                              f'{getattr(response, "status_code", None)}'
                 }
+            self.cache.set(key, result)
+            return result
 
 
 class ChuckyCustomGenerator(Callable):
@@ -228,8 +741,85 @@ class ChuckyCustomGenerator(Callable):
           bot(my_message)
 
           bot will return the result of a custom function: 'Python news!'
+
+          Functions which take an argument receive the ConversationState
+          of the user, the bot remembers the last key of a conversation:
+
+          def jobs_python(state):
+            return f'Python jobs for {state.sender}!'
+
+          bot.config = {'#Python': {'news': news_python,
+                                    'jobs': jobs_python}}
+          states = StateStore()
+          bot('Hey #Python send me your news', state=states.get(id_))
+          bot('and jobs', state=states.get(id_))  # 'Python jobs for ...'
     """
-    config = {}
+    def __init__(self, config=None, case_sensitive=True):
+        """
+        :param config: Dictionary {word: function} or
+                       {word: {topic: function}}, not required
+        :param case_sensitive: Match words exactly, when False
+                               '#python' matches '#Python', default True
+        """
+        self.case_sensitive = case_sensitive
+        # A subclass may define its config as a class attribute,
+        # it is compiled on first use
+        if config is not None or \
+                isinstance(type(self).config, property):
+            self.config = config or {}
+
+    @property
+    def config(self):
+        """
+        :return: Current config, type -> dict
+        """
+        return self._config
+
+    @config.setter
+    def config(self, value):
+        """
+        Compile the config into a word index, so dispatch is a single
+        pass over the message whatever the number of keys and topics.
+        If you change the dict in place, assign it again to recompile.
+        """
+        self._config = value
+        self._compile_index()
+
+    def _compile_index(self):
+        """
+        :return: Word index of the current config, compiled again
+        when another dict was assigned
+        """
+        config = self.config
+        if self.__dict__.get('_compiled') is not config:
+            self._index = self.compile(config)
+            self._takes_state = {}
+            self._compiled = config
+        return self._index
+
+    def _fold(self, word):
+        return word if self.case_sensitive else word.casefold()
+
+    def compile(self, config):
+        """
+        :param config: Dictionary {word: function} or
+                       {word: {topic: function}}
+        :return: A trie over words, every node is a dict
+                 {word: node}, the None key keeps (key, topic) pairs
+                 which end on that node, topic is None for config keys
+        """
+        index = {}
+        for key, value in config.items():
+            entries = [(key, None)]
+            if not isinstance(value, Callable):
+                entries.extend((key, topic) for topic in value)
+            for entry_key, topic in entries:
+                phrase = entry_key if topic is None else topic
+                node = index
+                for word in split_text(phrase):
+                    node = node.setdefault(self._fold(word), {})
+                node.setdefault(None, []).append((entry_key, topic))
+        return index
 
     def get_text(self, text: str):
         """
@@ -245,30 +835,87 @@ class ChuckyCustomGenerator(Callable):
         """
         return self.config.keys()
 
-    def check_and_run(self, text: str):
+    def find_matches(self, words):
         """
-        :param text: Some text, type -> str
+        :param words: an array with words
+        :return: (first config key found in the words,
+                  dictionary {config key: first topic found})
+        """
+        first_key = None
+        topics = {}
+        words = [self._fold(word) for word in words]
+        index = self._compile_index()
+        for start in range(len(words)):
+            node = index
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                for key, topic in node.get(None, ()):
+                    if topic is None:
+                        if first_key is None:
+                            first_key = key
+                    else:
+                        topics.setdefault(key, topic)
+        return first_key, topics
+
+    def _run(self, func, state):
+        """
+        :return: func(state) when func has a required argument and
+        there is a state, func() otherwise
+        """
+        if state is None:
+            return func()
+        takes_state = self._takes_state.get(func)
+        if takes_state is None:
+            try:
+                params = inspect.signature(func).parameters.values()
+            except (TypeError, ValueError):
+                params = ()
+            takes_state = self._takes_state[func] = any(
+                param.kind == param.VAR_POSITIONAL or
+                param.kind in (param.POSITIONAL_ONLY,
+                               param.POSITIONAL_OR_KEYWORD) and
+                param.default is param.empty
+                for param in params
+            )
+        return func(state) if takes_state else func()
+
+    def check_and_run(self, text, state=None):
+        """
+        :param text: an array with words, or some text, type -> str
+        :param state: ConversationState of the user, not required,
+                      when the text has no config key but names a
+                      topic of the previous key, that key is used
         :return: Function which match with config[key].
         """
-        func = None
-        for key in self.config_keys:
-            if key not in text:
-                return 'Sorry, could you repeat please?'
-            if key in text:
-                func = self.config.get(key)
-            if isinstance(func, Callable):
-                return func()
-            else:
-                for topic in self.config.get(key):
-                    if topic in text:
-                        func = self.config[key][topic]
-                        return func()
-                    if topic not in text:
-                        return 'I\'m Chucky bot, check your config'
-
-    def __call__(self, text, **kwargs):
+        if isinstance(text, str):
+            text = self.get_text(text)
+
+        key, topics = self.find_matches(text)
+        if key is None and state is not None and state.topic in topics \
+                and not isinstance(self.config.get(state.topic), Callable):
+            # A follow-up names a topic of the previous key, 'and jobs'
+            key = state.topic
+        if key is None:
+            return 'Sorry, could you repeat please?'
+
+        func = self.config[key]
+        if state is not None:
+            state.topic = key
+        if isinstance(func, Callable):
+            return self._run(func, state)
+
+        topic = topics.get(key)
+        if topic is None:
+            return 'I\'m Chucky bot, check your config'
+        if state is not None:
+            state.intent = topic
+        return self._run(func[topic], state)
+
+    def __call__(self, text, state=None, **kwargs):
         text = self.get_text(text)
-        return self.check_and_run(text)
+        return self.check_and_run(text, state)
 
     def __str__(self):
         return f'{self.__class__.__name__}' \
@@ -0,0 +1,162 @@
+""" Send API payloads and reply texts shared by the sync and async bots """
+
+import json
+from urllib import parse
+
+from .constants import MESSAGE_TEXT_LIMIT, WEATHER_ICON_URL
+from .errors import BotChuckyInvalidToken
+
+
+def text_payload(id_: str, text: str) -> dict:
+    """
+    :param id_: User facebook id, type -> str
+    :param text: some text, type -> str
+    :return: Send API body for a text message, type -> dict
+    """
+    return {
+        'recipient': {'id': id_},
+        'message': {'text': text}
+    }
+
+
+def image_payload(id_: str, url: str = None,
+                  attachment_id: str = None) -> dict:
+    """
+    :param id_: User facebook id, type -> str
+    :param url: Image url, type -> str
+    :param attachment_id: Id of an uploaded image, used instead of url
+    :return: Send API body for an image attachment, type -> dict
+    """
+    if attachment_id is not None:
+        payload = {'attachment_id': attachment_id}
+    else:
+        payload = {'url': url}
+    return {
+        'recipient': {'id': id_},
+        'message': {
+            'attachment': {
+                'type': 'image',
+                'payload': payload
+            }
+        }
+    }
+
+
+def action_payload(id_: str, action: str) -> dict:
+    """
+    :param id_: User facebook id, type -> str
+    :param action: 'typing_on', 'typing_off' or 'mark_seen'
+    :return: Send API body for a sender action, type -> dict
+    """
+    return {
+        'recipient': {'id': id_},
+        'sender_action': action
+    }
+
+
+def card_payload(id_: str, title: str, image_url: str,
+                 subtitle: str = None) -> dict:
+    """
+    :param id_: User facebook id, type -> str
+    :param title: Card title, cut to 80 characters, type -> str
+    :param image_url: Card image, type -> str
+    :param subtitle: Card subtitle, not required
+    :return: Send API body for a one element generic template
+    """
+    element = {'title': title[:80], 'image_url': image_url}
+    if subtitle:
+        element['subtitle'] = subtitle[:80]
+    return {
+        'recipient': {'id': id_},
+        'message': {
+            'attachment': {
+                'type': 'template',
+                'payload': {
+                    'template_type': 'generic',
+                    'elements': [element]
+                }
+            }
+        }
+    }
+
+
+def batch_item(payload: dict) -> dict:
+    """
+    :param payload: Send API body, type -> dict
+    :return: One operation of a Graph API batch request, type -> dict
+    """
+    body = {key: json.dumps(value) for key, value in payload.items()}
+    return {
+        'method': 'POST',
+        'relative_url': 'me/messages',
+        'body': parse.urlencode(body)
+    }
+
+
+def weather_reply(weather_info: dict, city_name: str):
+    """
+    :param weather_info: Open Weather response, type -> dict
+    :param city_name: City the user asked about, type -> str
+    :return: (text, icon url), icon is None when the city was not found
+    """
+    if weather_info['cod'] == 401:
+        raise BotChuckyInvalidToken(weather_info['message'])
+
+    if str(weather_info['cod']) == '404':
+        msg = f'Sorry I cant find information ' \
+              f'about weather in {city_name}, '
+        return msg, None
+
+    description = weather_info['weather'][0]['description']
+    icon = WEATHER_ICON_URL.format(weather_info['weather'][0]['icon'])
+    msg = f'Current weather in {city_name} is: {description}\n'
+    return msg, icon
+
+
+def unavailable_reply(service: str) -> str:
+    """
+    :param service: Service name shown to a user, type -> str
+    :return: Fallback reply while an upstream is unhealthy, type -> str
+    """
+    return f'Sorry, {service} is unavailable right now, ' \
+           f'please try again later'
+
+
+def stack_reply(answers: list) -> str:
+    """
+    :param answers: StackExchange links, type -> list
+    :return: Reply text with at most two links, type -> str
+    """
+    if not answers:
+        return 'I can\'t find questions for you;( try again'
+
+    if len(answers) == 1:
+        return f'I found question for you, link below\n\n ' \
+               f'Question: {answers[0]}'
+
+    return f'I found questions for you, links below\n\n ' \
+           f'Question 1: {answers[0]}\n' \
+           f'Question 2: {answers[1]}'
+
+
+def soundcloud_reply(artists, track_titles,
+                     limit=MESSAGE_TEXT_LIMIT) -> str:
+    """
+    :param artists: Artist names found by SoundCloud, type -> list
+    :param track_titles: Track titles, type -> iterable of str
+    :param limit: Max length of the reply, default the Messenger limit
+    :return: Reply text, the track listing is cut to fit, type -> str
+    """
+    head = f'SoundCloud found {", ".join(artists)}, \nTrack Listing: '
+    head = head[:limit // 2]
+    titles = list(track_titles)
+    listing = []
+    length = len(head)
+    for shown, title in enumerate(titles):
+        more = f' (+{len(titles) - shown} more)'
+        if length + len(title) + 2 + len(more) > limit:
+            listing.append(more.strip())
+            break
+        listing.append(title)
+        length += len(title) + 2
+    return head + ', '.join(listing)
@@ -0,0 +1,216 @@
+""" Per-upstream metrics of outbound calls """
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+_hook = None
+
+
+class Metrics:
+    """
+    Hook which keeps request counts, error counts by status/code,
+    in-flight gauges and latency histograms per upstream and operation.
+
+    :Example:
+          registry = metrics.enable()
+          bot.send_weather_message(id_, 'Kyiv')
+          print(registry.render_prometheus())
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='bot_chucky'):
+        """
+        :param buckets: Upper bounds of the latency histogram, seconds
+        :param prefix: Prefix of every metric name
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def call_started(self, upstream, operation):
+        with self._lock:
+            self.in_flight[(upstream, operation)] += 1
+
+    def call_finished(self, upstream, operation, seconds, status=None,
+                      code=None):
+        """
+        :param upstream: 'graph', 'openweather', 'stackexchange', ...
+        :param operation: Name of the call, e.g. 'send_message'
+        :param seconds: Call duration
+        :param status: HTTP status or exception name of a failed call
+        :param code: API error code of a failed call, not required
+        """
+        key = (upstream, operation)
+        with self._lock:
+            self.in_flight[key] -= 1
+            self.requests[key] += 1
+            if status is not None:
+                self.errors[key + (str(status), str(code or ''))] += 1
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+
+    def histogram(self, upstream, operation):
+        """
+        :return: (cumulative counts per bucket, +Inf count, sum),
+        None if there was no call
+        """
+        with self._lock:
+            histogram = self._histograms.get((upstream, operation))
+            if histogram is None:
+                return None
+            counts, total = list(histogram[0]), histogram[1]
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative[:-1], cumulative[-1], total
+
+    def render_prometheus(self):
+        """
+        :return: Metrics in the Prometheus text exposition format
+        """
+        name = self.prefix
+        lines = [
+            f'# HELP {name}_requests_total Outbound calls per upstream.',
+            f'# TYPE {name}_requests_total counter',
+        ]
+        with self._lock:
+            requests = sorted(self.requests.items())
+            errors = sorted(self.errors.items())
+            in_flight = sorted(self.in_flight.items())
+            keys = sorted(self._histograms)
+
+        for (upstream, operation), value in requests:
+            lines.append(f'{name}_requests_total{{upstream="{upstream}",'
+                         f'operation="{operation}"}} {value}')
+
+        lines += [
+            f'# HELP {name}_errors_total Failed outbound calls.',
+            f'# TYPE {name}_errors_total counter',
+        ]
+        for (upstream, operation, status, code), value in errors:
+            lines.append(f'{name}_errors_total{{upstream="{upstream}",'
+                         f'operation="{operation}",status="{status}",'
+                         f'code="{code}"}} {value}')
+
+        lines += [
+            f'# HELP {name}_in_flight Outbound calls in progress.',
+            f'# TYPE {name}_in_flight gauge',
+        ]
+        for (upstream, operation), value in in_flight:
+            lines.append(f'{name}_in_flight{{upstream="{upstream}",'
+                         f'operation="{operation}"}} {value}')
+
+        lines += [
+            f'# HELP {name}_latency_seconds Outbound call latency.',
+            f'# TYPE {name}_latency_seconds histogram',
+        ]
+        for upstream, operation in keys:
+            buckets, count, total = self.histogram(upstream, operation)
+            labels = f'upstream="{upstream}",operation="{operation}"'
+            for bound, value in zip(self.buckets, buckets):
+                lines.append(f'{name}_latency_seconds_bucket'
+                             f'{{{labels},le="{bound}"}} {value}')
+            lines.append(f'{name}_latency_seconds_bucket'
+                         f'{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{name}_latency_seconds_sum{{{labels}}} {total}')
+            lines.append(f'{name}_latency_seconds_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Call:
+    """
+    Context manager which reports one outbound call to the hook.
+    Set `status` (and `code`) inside the block for a failed response.
+    """
+    __slots__ = ('hook', 'upstream', 'operation', 'started',
+                 'status', 'code')
+
+    def __init__(self, hook, upstream, operation):
+        self.hook = hook
+        self.upstream = upstream
+        self.operation = operation
+        self.status = None
+        self.code = None
+
+    def __enter__(self):
+        self.hook.call_started(self.upstream, self.operation)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        status = self.status
+        if exc_type is not None:
+            status = exc_type.__name__
+        self.hook.call_finished(self.upstream, self.operation, seconds,
+                                status, self.code)
+
+
+class _NoopCall:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NOOP = _NoopCall()
+
+
+def track(upstream, operation):
+    """
+    :param upstream: 'graph', 'openweather', 'stackexchange',
+                     'soundcloud' or 'twitter'
+    :param operation: Name of the call, e.g. 'send_message'
+    :return: Context manager which times the call,
+    a shared no-op one when metrics are disabled
+    """
+    hook = _hook
+    if hook is None:
+        return _NOOP
+    return _Call(hook, upstream, operation)
+
+
+def set_hook(hook):
+    """
+    :param hook: Object with call_started(upstream, operation) and
+    call_finished(upstream, operation, seconds, status, code)
+    methods, None disables metrics
+    """
+    global _hook
+    _hook = hook
+
+
+def get_hook():
+    return _hook
+
+
+def enable(registry=None):
+    """
+    :param registry: Instance of Metrics, default a new one
+    :return: the registry which now receives every outbound call
+    """
+    registry = registry or Metrics()
+    set_hook(registry)
+    return registry
+
+
+def disable():
+    set_hook(None)
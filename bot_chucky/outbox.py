@@ -0,0 +1,256 @@
+""" Rate-limited outbound send queue """
+
+import functools
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+from .errors import BotChuckyError
+from .messages import text_payload
+from .transport import error_code
+
+# Graph API error codes which mean the app, user or page is throttled
+THROTTLE_CODES = frozenset({4, 17, 32, 613})
+PAGE_THROTTLE_CODE = 32
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, allows `rate` operations per second
+    with bursts up to `capacity`.
+    """
+    def __init__(self, rate, capacity=None, timer=time.monotonic):
+        """
+        :param rate: Tokens added per second, type -> float
+        :param capacity: Max tokens kept, at least 1, default rate
+        :param timer: Clock function, default time.monotonic
+        """
+        if rate <= 0:
+            raise ValueError('rate must be a positive number')
+        if capacity is not None and capacity < 1:
+            raise ValueError('capacity must hold at least one token')
+        self.rate = rate
+        self.capacity = max(1, capacity or rate)
+        self._tokens = self.capacity
+        self._timer = timer
+        self._updated = timer()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """
+        :return: Seconds to wait before a token is available,
+        0 when a token was taken
+        """
+        with self._lock:
+            now = self._timer()
+            if now < self._paused_until:
+                return self._paused_until - now
+            added = (now - self._updated) * self.rate
+            self._tokens = min(self.capacity, self._tokens + added)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Block until a token is available
+        """
+        wait = self._reserve()
+        while wait:
+            time.sleep(wait)
+            wait = self._reserve()
+
+    def pause(self, seconds):
+        """
+        :param seconds: Hand out no tokens for the next seconds
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     self._timer() + seconds)
+            self._tokens = 0
+
+
+class _Job:
+    __slots__ = ('bot', 'data', 'fallback', 'future', 'attempt')
+
+    def __init__(self, bot, data, fallback=None):
+        self.bot = bot
+        self.data = data
+        self.fallback = fallback
+        self.future = Future()
+        self.attempt = 0
+
+
+class SendQueue:
+    """
+    Class which queues Send API calls and drains them with background
+    workers through a global and a per page token bucket.
+    Messages to one user are always sent by the same worker,
+    so they keep their order.
+
+    :Example:
+          bot = BotChucky(token)
+          outbox = SendQueue(bot, workers=8, rate=250, page_rate=40)
+          future = outbox.send_message(sender_id, 'Hello!')
+          ...
+          outbox.shutdown()
+    """
+    def __init__(self, bot=None, workers=4, rate=250, page_rate=None,
+                 burst=None, max_retries=5, backoff=1, max_backoff=60,
+                 maxsize=0):
+        """
+        :param bot: Default BotChucky instance used to send messages
+        :param workers: Number of background threads, type -> int
+        :param rate: Messages per second for all pages together
+        :param page_rate: Messages per second for one page, not required
+        :param burst: Size of the global bucket, default rate
+        :param max_retries: Retries of a throttled message, type -> int
+        :param backoff: First pause after a throttling error, seconds
+        :param max_backoff: Longest pause, seconds
+        :param maxsize: Max queued messages per worker, 0 is unlimited
+        """
+        self.bot = bot
+        self.page_rate = page_rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate, burst)
+        self._page_buckets = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._queues = [queue.Queue(maxsize) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._worker, args=(q,), daemon=True,
+                             name=f'bot-chucky-outbox-{i}')
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _page_bucket(self, bot):
+        if self.page_rate is None:
+            return None
+        with self._lock:
+            bucket = self._page_buckets.get(bot.token)
+            if bucket is None:
+                bucket = TokenBucket(self.page_rate)
+                self._page_buckets[bot.token] = bucket
+            return bucket
+
+    def submit(self, id_: str, data, bot=None, fallback=None):
+        """
+        :param id_: User facebook id, type -> str
+        :param data: Send API body, type -> dict, or a function
+                     without arguments called by the worker to build it
+        :param bot: BotChucky instance, default self.bot
+        :param fallback: Function which takes the undelivered body and
+                         the response, and returns another body to
+                         send once, or None
+        :return: Future, its result is None for a delivered message
+        or the error text Facebook returned
+        """
+        if self._closed:
+            raise BotChuckyError('SendQueue is shut down')
+        bot = bot or self.bot
+        if bot is None:
+            raise BotChuckyError('SendQueue needs a bot to send with')
+
+        job = _Job(bot, data, fallback)
+        shard = zlib.crc32(id_.encode()) % len(self._queues)
+        self._queues[shard].put(job)
+        return job.future
+
+    def send_message(self, id_: str, text, bot=None):
+        """
+        :param  id_: User facebook id, type -> str
+        :param text: some text, type -> str
+        :return: Future
+        """
+        return self.submit(id_, text_payload(id_, text), bot)
+
+    def send_attachment(self, id_: str, attachment, bot=None):
+        """
+        :param  id_: User facebook id, type -> str
+        :param attachment: Attach any image
+        :return: Future, a new image is uploaded by the worker
+        """
+        bot = bot or self.bot
+        if bot is None:
+            raise BotChuckyError('SendQueue needs a bot to send with')
+        return self.submit(
+            id_, functools.partial(bot.attachment_payload, id_, attachment),
+            bot, functools.partial(bot.attachment_fallback, id_, attachment)
+        )
+
+    def _send(self, job):
+        page_bucket = self._page_bucket(job.bot)
+        if callable(job.data):
+            job.data = job.data()
+        while True:
+            self.bucket.acquire()
+            if page_bucket is not None:
+                page_bucket.acquire()
+
+            message = job.bot.post_payload(job.data, 'queued_send')
+            code = error_code(message)
+            if message.status_code == 200:
+                return None
+            if code not in THROTTLE_CODES or job.attempt >= self.max_retries:
+                data = None
+                if job.fallback is not None:
+                    data = job.fallback(job.data, message)
+                if data is None:
+                    return message.text
+                job.data, job.fallback, job.attempt = data, None, 0
+                continue
+
+            delay = min(self.max_backoff, self.backoff * 2 ** job.attempt)
+            job.attempt += 1
+            if code == PAGE_THROTTLE_CODE and page_bucket is not None:
+                page_bucket.pause(delay)
+            else:
+                self.bucket.pause(delay)
+
+    def _worker(self, jobs):
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    job.future.set_result(self._send(job))
+                except Exception as error:
+                    job.future.set_exception(error)
+            finally:
+                jobs.task_done()
+
+    def join(self):
+        """
+        Block until every queued message was sent
+        """
+        for jobs in self._queues:
+            jobs.join()
+
+    def shutdown(self, wait=True):
+        """
+        :param wait: Send the queued messages before returning
+        """
+        self._closed = True
+        for jobs in self._queues:
+            jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,172 @@
+""" Bots of many Facebook pages served by one process """
+
+import logging
+import threading
+
+from .bot import BotChucky
+from .cache import TTLCache
+from .errors import BotChuckyError
+from .helpers import FacebookData
+from .utils import lazy_property
+
+logger = logging.getLogger(__name__)
+
+
+def _shared(name):
+    """
+    :return: Read-only property which reads `name` from the shared bot
+    """
+    return property(lambda self: getattr(self.registry.shared, name),
+                    doc=f'{name} of the shared bot')
+
+
+class PageBot(BotChucky):
+    """
+    BotChucky of one page, it keeps only the page token and params,
+    the transport, endpoints and helper clients are the ones of the
+    registry's shared bot.
+    """
+    api_url = _shared('api_url')
+    graph_url = _shared('graph_url')
+    attachment_api_url = _shared('attachment_api_url')
+    transport = _shared('transport')
+    headers = _shared('headers')
+    open_weather_token = _shared('open_weather_token')
+    twitter_tokens = _shared('twitter_tokens')
+    soundcloud_id = _shared('soundcloud_id')
+    weather = _shared('weather')
+    twitter = _shared('twitter')
+    soundcloud = _shared('soundcloud')
+    stack = _shared('stack')
+    executor = _shared('executor')
+
+    def __init__(self, registry, page_id, token, attachments=None):
+        """
+        :param registry: PageRegistry the page belongs to
+        :param page_id: Facebook Page id, type -> str
+        :param token: Page token
+        :param attachments: Instance of AttachmentRegistry, attachment
+        ids belong to one page so it is never shared, not required
+        """
+        self.registry = registry
+        self.page_id = page_id
+        self.token = token
+        self.params = {'access_token': token}
+        self.attachments = attachments
+
+    @lazy_property
+    def fb(self):
+        # User ids are page-scoped, so one cache serves every page
+        return FacebookData(self.token, transport=self.transport,
+                            cache=self.registry.user_names)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(page_id={self.page_id!r})'
+
+
+class PageRegistry:
+    """
+    Class which routes webhook events to the bot of their page by
+    entry.id. Pages share one transport, so one connection pool, and
+    one set of helper clients and caches.
+
+    :Example:
+          registry = PageRegistry({'PAGE_ID': 'PAGE_TOKEN'},
+                                  open_weather_token='TOKEN')
+          registry.add('OTHER_PAGE_ID', 'OTHER_PAGE_TOKEN')
+
+          def handle(bot, event):
+              bot.send_weather_message(event.sender, event.text)
+
+          app = WebhookApp(registry.handler(handle), 'VERIFY_TOKEN')
+    """
+    def __init__(self, pages=None, **kwargs):
+        """
+        :param pages: Dictionary {page id: page token}, not required
+        :param kwargs: Arguments of BotChucky, except the token,
+                       used to build the shared bot
+        """
+        self.shared = BotChucky(None, **kwargs)
+        self._pages = {}
+        self._lock = threading.Lock()
+        for page_id, token in (pages or {}).items():
+            self.add(page_id, token)
+
+    @lazy_property
+    def user_names(self):
+        return TTLCache(maxsize=10000, ttl=3600)
+
+    def add(self, page_id, token, attachments=None) -> PageBot:
+        """
+        :param page_id: Facebook Page id, type -> str
+        :param token: Page token, it replaces the previous one
+        :param attachments: Instance of AttachmentRegistry of the page
+        :return: PageBot of the page
+        """
+        bot = PageBot(self, str(page_id), token, attachments)
+        with self._lock:
+            self._pages[bot.page_id] = bot
+        return bot
+
+    def remove(self, page_id):
+        """
+        :param page_id: Facebook Page id, type -> str
+        """
+        with self._lock:
+            self._pages.pop(str(page_id), None)
+
+    def get(self, page_id):
+        """
+        :param page_id: Facebook Page id, type -> str
+        :return: PageBot of the page, None if the page is unknown
+        """
+        return self._pages.get(str(page_id))
+
+    def bot_for(self, event) -> PageBot:
+        """
+        :param event: MessageEvent object
+        :return: PageBot of the page which received the event
+        """
+        bot = self.get(event.page_id)
+        if bot is None:
+            raise BotChuckyError(f'Unknown page {event.page_id}')
+        return bot
+
+    def handler(self, handle):
+        """
+        :param handle: Function which takes (PageBot, MessageEvent)
+        :return: Event handler for WebhookApp, events of unknown
+        pages are logged and dropped
+        """
+        def dispatch(event):
+            bot = self.get(event.page_id)
+            if bot is None:
+                logger.warning('Dropped event of unknown page %s',
+                               event.page_id)
+                return
+            handle(bot, event)
+        return dispatch
+
+    def generator_handler(self, generator, states=None):
+        """
+        :param generator: ChuckyCustomGenerator instance
+        :param states: StateStore instance, not required
+        :return: Event handler which replies with the generator result
+        from the page which received the message
+        """
+        def handle(bot, event):
+            if event.text:
+                state = states.get(event.sender) \
+                    if states is not None else None
+                bot.send_message(event.sender,
+                                 generator(event.text, state=state))
+        return self.handler(handle)
+
+    def __contains__(self, page_id):
+        return str(page_id) in self._pages
+
+    def __iter__(self):
+        return iter(list(self._pages.values()))
+
+    def __len__(self):
+        return len(self._pages)
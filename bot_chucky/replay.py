@@ -0,0 +1,287 @@
+"""
+Record webhook deliveries and replay them as load
+
+Record with WebhookApp(..., recorder=Recorder('traffic.jsonl.gz')), then:
+    python -m bot_chucky.replay traffic.jsonl.gz --rate 200 --latency 0.05
+    python -m bot_chucky.replay traffic.jsonl.gz --speed 10 --max-p99-ms 500
+
+The bot talks to a local StubServer, so no message leaves the machine.
+"""
+
+import argparse
+import gzip
+import importlib
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .errors import BotChuckyError
+from .utils import iter_message_events, json_loads
+
+
+def percentile(values, pct):
+    """
+    :param values: Sorted values, type -> list
+    :param pct: Percentile, 0-100
+    :return: Nearest-rank percentile
+    """
+    if not values:
+        return 0.0
+    rank = int(round(pct / 100 * len(values))) - 1
+    rank = max(0, min(len(values) - 1, rank))
+    return values[rank]
+
+
+class Recorder:
+    """
+    Class which appends webhook deliveries to a gzip compressed JSONL
+    file, one {'t': unix time, 'body': delivery} object per line.
+    Every `flush_every` records, and on close, the buffered lines are
+    appended as a complete gzip member, so the file stays readable
+    while it is written and after the process dies.
+    """
+    def __init__(self, path, flush_every=100):
+        """
+        :param path: File to append to, e.g. 'traffic.jsonl.gz'
+        :param flush_every: Number of records between flushes
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def record(self, payload, timestamp=None):
+        """
+        :param payload: Webhook delivery, type -> dict,
+                        or the raw request body, type -> bytes / str
+        :param timestamp: Unix time of the delivery, default now
+        """
+        if isinstance(payload, (bytes, bytearray, str)):
+            payload = json_loads(payload)
+        line = json.dumps({'t': timestamp or time.time(), 'body': payload})
+        with self._lock:
+            self._lines.append(line + '\n')
+            self.count += 1
+            if len(self._lines) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        if not self._lines:
+            return
+        data = gzip.compress(''.join(self._lines).encode('utf-8'))
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self._lines = []
+
+    def flush(self):
+        """
+        Append the buffered records to the file
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_recording(path):
+    """
+    :param path: File written by Recorder
+    :return: a generator of (unix time, delivery dict), a last member
+    cut short by a crash ends the recording instead of raising
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        while True:
+            try:
+                line = f.readline()
+            except (EOFError, OSError):
+                return
+            if not line:
+                return
+            if not line.endswith('\n'):
+                # Partial line of a truncated member
+                return
+            if line.strip():
+                record = json_loads(line)
+                yield record['t'], record['body']
+
+
+def events_handler(handler, types=frozenset({'message', 'postback'})):
+    """
+    :param handler: Function which takes a MessageEvent
+    :param types: Event types passed to the handler
+    :return: Function which takes a delivery and calls handler
+    for each of its events
+    """
+    def handle(payload):
+        for event in iter_message_events(payload, types):
+            handler(event)
+    return handle
+
+
+def replay(records, handler, rate=None, speed=None, concurrency=8):
+    """
+    Replay deliveries against a handler on a pool of threads.
+    Deliveries are started on schedule whatever the handler latency,
+    and latency is measured from the scheduled time, so a saturated
+    handler shows up as growing latency instead of a slower schedule.
+
+    :param records: Iterable of (unix time, delivery dict), e.g.
+                    read_recording(path)
+    :param handler: Function which takes a delivery dict
+    :param rate: Deliveries per second, not required
+    :param speed: Time-scale of the recording, 2 replays it twice
+                  as fast, used when rate is None. Without rate and
+                  speed deliveries are started as fast as possible
+    :param concurrency: Number of threads running the handler
+    :return: dictionary with throughput, latency percentiles in ms
+    and error counts
+    """
+    errors = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def run(payload, scheduled):
+        error = None
+        try:
+            handler(payload)
+        except Exception as exc:
+            error = type(exc).__name__
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            if error is not None:
+                errors[error] += 1
+
+    started = time.perf_counter()
+    first = None
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, (timestamp, payload) in enumerate(records):
+            if first is None:
+                first = timestamp
+            if rate:
+                scheduled = started + i / rate
+            elif speed:
+                scheduled = started + (timestamp - first) / speed
+            else:
+                scheduled = time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, payload, scheduled)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    failed = sum(errors.values())
+    return {
+        'deliveries': count,
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        'errors': failed,
+        'error_rate': failed / count if count else 0.0,
+        'error_types': dict(errors),
+    }
+
+
+def echo_handler(bot):
+    """
+    :param bot: BotChucky instance
+    :return: Delivery handler which sends every text back to its sender,
+    a message Facebook rejects is counted as an error
+    """
+    def handle(event):
+        if event.text:
+            error = bot.send_message(event.sender, event.text)
+            if error is not None:
+                raise BotChuckyError(error)
+    return events_handler(handle)
+
+
+def load_factory(name):
+    """
+    :param name: 'package.module:function'
+    :return: the function
+    """
+    module, _, attribute = name.partition(':')
+    return getattr(importlib.import_module(module), attribute)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay recorded webhook deliveries against a bot '
+                    'talking to local stub APIs'
+    )
+    parser.add_argument('path', help='file written by Recorder')
+    parser.add_argument('--handler', default=None,
+                        help='module:function which takes a BotChucky and '
+                             'returns a delivery handler, default echo')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='deliveries per second')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='time-scale of the recording')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='stub latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--json', default=None,
+                        help='write the report to this file')
+    parser.add_argument('--max-p99-ms', type=float, default=None,
+                        help='fail when p99 latency is higher')
+    parser.add_argument('--max-error-rate', type=float, default=None,
+                        help='fail when the error rate is higher')
+    args = parser.parse_args(argv)
+
+    from .bot import BotChucky
+    from .stubs import StubServer
+    from .transport import Transport
+
+    factory = load_factory(args.handler) if args.handler else echo_handler
+    with StubServer(latency=args.latency, jitter=args.jitter,
+                    error_rate=args.error_rate) as server, \
+            Transport(pool_maxsize=max(args.concurrency, 10)) as transport:
+        bot = BotChucky('TOKEN', open_weather_token='TOKEN',
+                        transport=transport)
+        server.configure(bot)
+        report = replay(read_recording(args.path), factory(bot),
+                        rate=args.rate, speed=args.speed,
+                        concurrency=args.concurrency)
+        report['upstream_requests'] = dict(server.requests)
+        report['upstream_errors'] = dict(server.errors)
+
+    print(f'{report["deliveries"]} deliveries in {report["elapsed"]:.2f}s, '
+          f'{report["throughput"]:.1f}/s')
+    print(f'latency ms p50 {report["p50_ms"]:.2f}  '
+          f'p90 {report["p90_ms"]:.2f}  p99 {report["p99_ms"]:.2f}  '
+          f'max {report["max_ms"]:.2f}')
+    print(f'errors {report["errors"]} ({report["error_rate"]:.2%}) '
+          f'{report["error_types"]}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = args.max_p99_ms is not None and \
+        report['p99_ms'] > args.max_p99_ms or \
+        args.max_error_rate is not None and \
+        report['error_rate'] > args.max_error_rate
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+""" Retries and circuit breakers for outbound calls """
+
+import random
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, used for idempotent lookups
+    """
+    def __init__(self, retries=2, backoff=0.2, max_backoff=2.0):
+        """
+        :param retries: Retries after the first attempt, type -> int
+        :param backoff: Base delay, seconds
+        :param max_backoff: Longest delay, seconds
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delays(self):
+        """
+        :return: a generator of delays before every retry, seconds
+        """
+        for attempt in range(self.retries):
+            yield random.uniform(0, min(self.max_backoff,
+                                        self.backoff * 2 ** attempt))
+
+
+NO_RETRY = RetryPolicy(retries=0)
+
+
+class CircuitBreaker:
+    """
+    Class which stops calls to an upstream after `failure_threshold`
+    failures in a row. After `reset_timeout` seconds one trial call is
+    let through, its success closes the breaker again.
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=30,
+                 timer=time.monotonic):
+        """
+        :param name: Upstream name, type -> str
+        :param failure_threshold: Failures in a row which open the breaker
+        :param reset_timeout: Seconds before a trial call, default 30
+        :param timer: Clock function, default time.monotonic
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._timer = timer
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        :return: 'closed', 'open' or 'half_open'
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened is None:
+            return CLOSED
+        if self._timer() - self._opened >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self) -> bool:
+        """
+        :return: True when a call may go to the upstream
+        """
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self._opened = self._timer()
+            self._trial = False
+
+    def reset(self):
+        self.record_success()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r}, ' \
+               f'state={self.state!r}, failures={self.failures})'
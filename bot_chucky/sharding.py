@@ -0,0 +1,118 @@
+""" Multi-process event processing sharded by sender ID """
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(sender, shards) -> int:
+    """
+    :param sender: Sender ID, type -> str
+    :param shards: Number of shards, type -> int
+    :return: Shard of the sender, the same in every process and run
+    """
+    return zlib.crc32(str(sender).encode()) % shards
+
+
+def _worker(factory, events):
+    # The parent process handles Ctrl+C and drains the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handler = factory()
+    while True:
+        event = events.get()
+        try:
+            if event is None:
+                return
+            handler(event)
+        except Exception:
+            logger.exception('Webhook handler failed on %r', event)
+        finally:
+            events.task_done()
+
+
+class ShardedDispatcher:
+    """
+    Class which runs an event handler in a fixed set of worker
+    processes. Events of one sender always go to the same process and
+    are handled in order, different senders are handled in parallel on
+    every core. Each process builds its own handler, so its BotChucky
+    and connection pool are never shared.
+
+    :Example:
+          def make_handler():
+              bot = BotChucky(token)
+              return generator_handler(bot, ChuckyCustomGenerator(config))
+
+          dispatcher = ShardedDispatcher(make_handler, processes=8)
+          app = WebhookApp(None, 'VERIFY_TOKEN', dispatcher=dispatcher)
+    """
+    def __init__(self, factory, processes=None, maxsize=1000, context=None):
+        """
+        :param factory: Picklable function without arguments, called once
+                        in every process, which returns an event handler
+        :param processes: Number of worker processes, default CPU count
+        :param maxsize: Max events waiting in each process, type -> int
+        :param context: Multiprocessing start method, e.g. 'spawn',
+                        default the platform one
+        """
+        ctx = multiprocessing.get_context(context)
+        self.processes = processes or os.cpu_count() or 1
+        self._queues = [ctx.JoinableQueue(maxsize)
+                        for _ in range(self.processes)]
+        self._closed = False
+        self._workers = [
+            ctx.Process(target=_worker, args=(factory, events), daemon=True,
+                        name=f'bot-chucky-shard-{i}')
+            for i, events in enumerate(self._queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, event) -> bool:
+        """
+        :param event: MessageEvent object
+        :return: False when the queue of its shard is full
+        or the dispatcher is closed
+        """
+        if self._closed:
+            return False
+        events = self._queues[shard_of(event.sender, self.processes)]
+        try:
+            events.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def join(self):
+        """
+        Block until every queued event was handled
+        """
+        for events in self._queues:
+            events.join()
+
+    def shutdown(self, wait=True):
+        """
+        :param wait: Handle the queued events before returning,
+                     otherwise the worker processes are terminated
+        """
+        self._closed = True
+        for events, worker in zip(self._queues, self._workers):
+            if wait:
+                events.put(None)
+            else:
+                events.cancel_join_thread()
+                worker.terminate()
+        for events, worker in zip(self._queues, self._workers):
+            worker.join()
+            events.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,181 @@
+""" Per-user conversation state """
+
+import shelve
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConversationState:
+    """
+    State of the conversation with one user: the config key being
+    discussed, the last topic matched under it and when the
+    conversation started and was last active.
+    `data` is None until a handler stores its own values in it.
+    """
+    __slots__ = ('sender', 'topic', 'intent', 'created', 'updated', 'data')
+
+    def __init__(self, sender, topic=None, intent=None, created=None,
+                 updated=None, data=None):
+        self.sender = sender
+        self.topic = topic
+        self.intent = intent
+        self.created = created
+        self.updated = updated
+        self.data = data
+
+    def to_tuple(self):
+        """
+        :return: Record fields, in __slots__ order, type -> tuple
+        """
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, fields):
+        return cls(*fields)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(sender={self.sender!r}, ' \
+               f'topic={self.topic!r}, intent={self.intent!r})'
+
+
+class StateStore:
+    """
+    Thread-safe store of ConversationState records keyed by sender ID.
+    At most `maxsize` records are kept in memory, the least recently
+    used ones are evicted first, and records idle for `ttl` seconds
+    are dropped. With a path, evicted records are spilled to a shelve
+    file and loaded back when the user writes again.
+    Use one file per process, shelve does not support several writers.
+
+    :Example:
+          states = StateStore(maxsize=100000, ttl=3600)
+          state = states.get(event.sender)
+          generator(event.text, state=state)
+    """
+    def __init__(self, maxsize=100000, ttl=3600, path=None,
+                 timer=time.time):
+        """
+        :param maxsize: Max number of records kept in memory
+        :param ttl: Seconds of inactivity after which a record is
+                    dropped, None keeps records until they are evicted
+        :param path: Shelve file for evicted records, not required
+        :param timer: Clock function, default time.time
+        """
+        if maxsize <= 0:
+            raise ValueError('maxsize must be a positive number')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._timer = timer
+        self._states = OrderedDict()
+        self._disk = shelve.open(path) if path else None
+        self._lock = threading.Lock()
+
+    def _expired(self, state, now):
+        return self.ttl is not None and now - state.updated >= self.ttl
+
+    def _load(self, sender, now):
+        if self._disk is None:
+            return None
+        fields = self._disk.pop(sender, None)
+        if fields is None:
+            return None
+        state = ConversationState.from_tuple(fields)
+        return None if self._expired(state, now) else state
+
+    def _evict(self, now):
+        while len(self._states) > self.maxsize:
+            sender, state = self._states.popitem(last=False)
+            if self._disk is not None and not self._expired(state, now):
+                self._disk[sender] = state.to_tuple()
+
+    def get(self, sender) -> ConversationState:
+        """
+        :param sender: Sender ID, type -> str
+        :return: State of the sender, a new one when there is none
+        or it was idle too long. The record is marked as active.
+        """
+        sender = str(sender)
+        with self._lock:
+            now = self._timer()
+            state = self._states.get(sender)
+            if state is not None and self._expired(state, now):
+                state = None
+            if state is None:
+                state = self._load(sender, now) or \
+                    ConversationState(sender, created=now)
+                self._states[sender] = state
+            state.updated = now
+            self._states.move_to_end(sender)
+            self._evict(now)
+            return state
+
+    def peek(self, sender):
+        """
+        :param sender: Sender ID, type -> str
+        :return: State kept in memory, None when there is none,
+        the record is not marked as active
+        """
+        state = self._states.get(str(sender))
+        if state is None or self._expired(state, self._timer()):
+            return None
+        return state
+
+    def delete(self, sender):
+        """
+        :param sender: Sender ID, type -> str
+        """
+        sender = str(sender)
+        with self._lock:
+            self._states.pop(sender, None)
+            if self._disk is not None:
+                self._disk.pop(sender, None)
+
+    def sweep(self):
+        """
+        Drop the idle records from memory and from the file
+
+        :return: Number of dropped records
+        """
+        dropped = 0
+        with self._lock:
+            now = self._timer()
+            for sender in list(self._states):
+                if self._expired(self._states[sender], now):
+                    del self._states[sender]
+                    dropped += 1
+            if self._disk is not None:
+                for sender in list(self._disk.keys()):
+                    state = ConversationState.from_tuple(self._disk[sender])
+                    if self._expired(state, now):
+                        del self._disk[sender]
+                        dropped += 1
+        return dropped
+
+    def close(self):
+        """
+        Spill every record to the file, when there is one, and close it
+        """
+        with self._lock:
+            if self._disk is None:
+                return
+            now = self._timer()
+            for sender, state in self._states.items():
+                if not self._expired(state, now):
+                    self._disk[sender] = state.to_tuple()
+            self._states.clear()
+            self._disk.close()
+            self._disk = None
+
+    def __contains__(self, sender):
+        return self.peek(sender) is not None
+
+    def __len__(self):
+        return len(self._states)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
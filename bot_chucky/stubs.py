@@ -0,0 +1,186 @@
+""" Local stand-in for the Graph, Open Weather and StackExchange APIs """
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib import parse
+
+UNKNOWN_CITIES = frozenset({'nowhere', 'atlantis'})
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _handle(self, method):
+        stub = self.server.stub
+        url = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(url.query))
+        body = self._body() if method == 'POST' else b''
+        stub.requests[url.path] += 1
+
+        delay = stub.latency + random.uniform(0, stub.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if stub.error_rate and random.random() < stub.error_rate:
+            stub.errors[url.path] += 1
+            return self._reply(stub.error_status, {'error': {
+                'message': 'Injected error', 'code': stub.error_code
+            }})
+
+        status, reply = stub.route(method, url.path, query, body)
+        return self._reply(status, reply)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class StubServer:
+    """
+    Local HTTP server which answers like graph.facebook.com,
+    api.openweathermap.org and api.stackexchange.com,
+    with configurable latency and error injection.
+
+    :Example:
+          with StubServer(latency=0.05, error_rate=0.01) as server:
+              bot = BotChucky('TOKEN', open_weather_token='TOKEN')
+              server.configure(bot)
+              bot.send_weather_message('1', 'Kyiv')
+              print(server.requests)
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=400, error_code=613):
+        """
+        :param host: Interface to listen on, default 127.0.0.1
+        :param port: Port to listen on, default a free one
+        :param latency: Seconds every request is delayed
+        :param jitter: Extra random delay, up to jitter seconds
+        :param error_rate: Share of requests answered with an error
+        :param error_status: HTTP status of injected errors
+        :param error_code: Graph API error code of injected errors
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_code = error_code
+        self.requests = Counter()
+        self.errors = Counter()
+        self._server = _ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        :return: Base url of the server, type -> str
+        """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def route(self, method, path, query, body):
+        """
+        :return: (HTTP status, JSON body) for a request
+        """
+        if path.endswith('/me/messages'):
+            return 200, {'recipient_id': '1', 'message_id': 'mid.stub'}
+        if path.endswith('/me/message_attachments'):
+            return 200, {'attachment_id': str(abs(hash(body)))}
+        if path.startswith('/graph') and method == 'POST':
+            batch = json.loads(dict(parse.parse_qsl(body.decode()))['batch'])
+            return 200, [{'code': 200, 'body': '{}'} for _ in batch]
+        if path.startswith('/graph') and 'ids' in query:
+            return 200, {_id: {'id': _id, 'first_name': f'User {_id}'}
+                         for _id in query['ids'].split(',')}
+        if path.startswith('/graph'):
+            _id = path.rsplit('/', 1)[-1]
+            return 200, {'id': _id, 'first_name': f'User {_id}'}
+        if path.endswith('/weather'):
+            return self.weather(query.get('q') or f'City {query.get("id")}')
+        if path.endswith('/group'):
+            reports = [dict(self.weather(f'City {_id}')[1], id=int(_id))
+                       for _id in query.get('id', '').split(',')]
+            return 200, {'cnt': len(reports), 'list': reports}
+        if path.endswith('/search/advanced'):
+            title = query.get('title') or query.get('tagged') or ''
+            return 200, {'items': [
+                {'link': f'https://stackoverflow.com/q/{i}/{title}'}
+                for i in range(int(query.get('pagesize', 30)))
+            ], 'quota_max': 10000, 'quota_remaining': 9999}
+        if path.endswith('/filters/create'):
+            return 200, {'items': [{'filter': '!stub', 'filter_type': 'safe',
+                                    'included_fields': query['include']}]}
+        if path.endswith('/users') or path.endswith('/tracks'):
+            return 200, [{'id': i, 'title': f'Track {i}',
+                          'username': query.get('q')}
+                         for i in range(int(query.get('limit', 50)))]
+        return 404, {'error': {'message': f'Unknown path {path}'}}
+
+    @staticmethod
+    def weather(city_name):
+        if city_name.lower() in UNKNOWN_CITIES:
+            return 200, {'cod': '404', 'message': 'city not found'}
+        return 200, {
+            'cod': 200,
+            'name': city_name,
+            'weather': [{'id': 800, 'main': 'Clear',
+                         'description': 'clear sky', 'icon': '01d'}]
+        }
+
+    def configure(self, bot):
+        """
+        Point a BotChucky instance and its helpers at this server
+
+        :param bot: BotChucky instance
+        :return: the same bot
+        """
+        bot.api_url = f'{self.url}/graph/me/messages'
+        bot.graph_url = f'{self.url}/graph'
+        bot.attachment_api_url = f'{self.url}/graph/me/message_attachments'
+        bot.weather.api_url = f'{self.url}/data/2.5/weather'
+        bot.stack.api_url = f'{self.url}/2.2/search/advanced'
+        return bot
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,238 @@
+""" Pooled HTTP transport """
+
+import threading
+import time
+
+from .errors import BotChuckyCircuitOpen, BotChuckyUpstreamError
+from .metrics import track
+from .resilience import NO_RETRY, CircuitBreaker, RetryPolicy
+
+# Status codes which count as a failure of the upstream itself
+UPSTREAM_FAILURES = frozenset({429, 500, 502, 503, 504})
+
+DEFAULT_TIMEOUT = (3.05, 10)
+
+
+class Transport:
+    """
+    Class which owns the pooled, keep-alive HTTP sessions used for every
+    outbound call (Graph API, Open Weather, StackExchange).
+
+    :Example:
+          transport = Transport(pool_maxsize=100, timeout=5)
+          bot = BotChucky(token, transport=transport)
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=50,
+                 max_retries=0, timeout=DEFAULT_TIMEOUT, keep_alive=True,
+                 pool_block=False, timeouts=None, retry=None,
+                 failure_threshold=5, reset_timeout=30):
+        """
+        :param pool_connections: Number of per-host pools to cache
+        :param pool_maxsize: Max connections kept alive per host
+        :param max_retries: Retries for failed connections, type -> int
+        :param timeout: Default timeout, seconds or (connect, read) tuple
+        :param keep_alive: Reuse connections between requests, default True
+        :param pool_block: Block when the pool is exhausted instead of
+        opening a throwaway connection
+        :param timeouts: Timeout per upstream, e.g. {'openweather': 2},
+        upstreams which are not listed use timeout
+        :param retry: RetryPolicy for idempotent lookups,
+        default RetryPolicy(), NO_RETRY turns retries off
+        :param failure_threshold: Failures in a row which open the
+        circuit breaker of an upstream
+        :param reset_timeout: Seconds before an open breaker lets a
+        trial call through
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.pool_block = pool_block
+        self.timeouts = dict(timeouts or {})
+        self.retry = retry or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _build_session(self):
+        import requests as r
+        from requests.adapters import HTTPAdapter
+
+        session = r.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=self.max_retries,
+                              pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    @property
+    def session(self):
+        """
+        :return: Shared requests.Session, created on first use
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def breaker(self, upstream):
+        """
+        :param upstream: Upstream name, e.g. 'openweather'
+        :return: CircuitBreaker of the upstream
+        """
+        breaker = self.breakers.get(upstream)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(upstream, CircuitBreaker(
+                    upstream, self.failure_threshold, self.reset_timeout
+                ))
+        return breaker
+
+    def breaker_states(self):
+        """
+        :return: dictionary {upstream: 'closed', 'open' or 'half_open'}
+        """
+        return {name: breaker.state
+                for name, breaker in list(self.breakers.items())}
+
+    def call(self, upstream, operation, func, *args, idempotent=True,
+             ignore=(), **kwargs):
+        """
+        Run func through the circuit breaker of the upstream,
+        retrying idempotent calls which raised.
+
+        :param upstream: Upstream name, e.g. 'soundcloud'
+        :param operation: Operation name used by metrics
+        :param func: Function which calls the upstream, e.g. an SDK method
+        :param idempotent: Retry the call when it fails
+        :param ignore: Exception types which are API answers, such as an
+        unknown user, they are raised at once and are not failures
+        :return: func result, exceptions of the last attempt are raised
+        """
+        breaker = self.breaker(upstream)
+        if not breaker.allow():
+            raise BotChuckyCircuitOpen(upstream)
+
+        delays = (self.retry if idempotent else NO_RETRY).delays()
+        while True:
+            try:
+                with track(upstream, operation):
+                    result = func(*args, **kwargs)
+            except ignore:
+                breaker.record_success()
+                raise
+            except Exception:
+                breaker.record_failure()
+                delay = next(delays, None)
+                if delay is None or not breaker.allow():
+                    raise
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+    def request(self, method, url, upstream='http', operation='request',
+                **kwargs):
+        """
+        :param method: HTTP method, type -> str
+        :param url: Request url, type -> str
+        :param upstream: Upstream name used by metrics, timeouts
+        and circuit breakers, e.g. 'graph'
+        :param operation: Operation name used by metrics
+        :param kwargs: Any requests keyword argument
+        :return: requests.Response object
+        """
+        import requests as r
+
+        kwargs.setdefault('timeout', self.timeouts.get(upstream, self.timeout))
+        breaker = self.breaker(upstream)
+        if not breaker.allow():
+            raise BotChuckyCircuitOpen(upstream)
+
+        retry = self.retry if method in ('GET', 'HEAD') else NO_RETRY
+        delays = retry.delays()
+        while True:
+            response = error = None
+            with track(upstream, operation) as call:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except r.RequestException as exc:
+                    error = exc
+                    call.status = exc.__class__.__name__
+                else:
+                    if response.status_code >= 400:
+                        call.status = response.status_code
+                        call.code = error_code(response)
+
+            if error is None and \
+                    response.status_code not in UPSTREAM_FAILURES:
+                breaker.record_success()
+                return response
+
+            breaker.record_failure()
+            delay = next(delays, None)
+            if delay is None or not breaker.allow():
+                if error is not None:
+                    raise BotChuckyUpstreamError(upstream, str(error)) \
+                        from error
+                return response
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """
+        Close every pooled connection
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def error_code(response):
+    """
+    :param response: requests.Response object
+    :return: Graph API style error code, None if there is no error
+    """
+    if response.status_code == 200:
+        return None
+    try:
+        return response.json()['error']['code']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def get_default_transport():
+    """
+    :return: Process wide Transport shared by every client
+    which was not given its own transport
+    """
+    global _default_transport
+    if _default_transport is None:
+        with _default_lock:
+            if _default_transport is None:
+                _default_transport = Transport()
+    return _default_transport
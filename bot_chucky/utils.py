@@ -1,5 +1,149 @@
 """ Utils functions"""
 
+import threading
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
+
+
+class lazy_property:
+    """
+    Decorator which computes an attribute on first access and stores
+    it on the instance, so later reads are plain attribute lookups.
+    The attribute can also be assigned before first use.
+    It is computed once even when several threads read it first at
+    the same time, the lock is per instance and is dropped once the
+    value is stored. Keep network calls out of the decorated method.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self.lock_name = f'_{func.__name__}_lock'
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # setdefault is atomic, so racing threads get the same lock
+        lock = instance.__dict__.setdefault(self.lock_name,
+                                            threading.RLock())
+        with lock:
+            # Another thread may have computed it while this one waited
+            try:
+                return instance.__dict__[self.name]
+            except KeyError:
+                pass
+            value = instance.__dict__[self.name] = self.func(instance)
+        instance.__dict__.pop(self.lock_name, None)
+        return value
+
+
+class MessageEvent:
+    """
+    One messaging event of a webhook delivery
+
+    :param page_id: Page id of the entry the event belongs to
+    :param sender: User id which sent the event, type -> str
+    :param recipient: Page id which received the event, type -> str
+    :param mid: Message id, None for non-message events
+    :param text: User text, None when the message has no text
+    :param timestamp: Event time in milliseconds, type -> int
+    :param type: 'message', 'echo', 'postback', 'delivery', 'read',
+                 'optin' or 'unknown'
+    :param payload: Postback or quick reply payload, not required
+    """
+    __slots__ = ('page_id', 'sender', 'recipient', 'mid', 'text',
+                 'timestamp', 'type', 'payload')
+
+    def __init__(self, page_id, sender, recipient, mid, text, timestamp,
+                 type, payload=None):
+        self.page_id = page_id
+        self.sender = sender
+        self.recipient = recipient
+        self.mid = mid
+        self.text = text
+        self.timestamp = timestamp
+        self.type = type
+        self.payload = payload
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(type={self.type!r}, ' \
+               f'sender={self.sender!r}, mid={self.mid!r}, ' \
+               f'text={self.text!r})'
+
+
+def _parse_event(page_id, event: dict) -> MessageEvent:
+    sender = event.get('sender', {}).get('id')
+    recipient = event.get('recipient', {}).get('id')
+    timestamp = event.get('timestamp')
+    message = event.get('message')
+
+    if message is not None:
+        quick_reply = message.get('quick_reply') or {}
+        return MessageEvent(
+            page_id, sender, recipient, message.get('mid'),
+            message.get('text'), timestamp,
+            'echo' if message.get('is_echo') else 'message',
+            quick_reply.get('payload')
+        )
+
+    postback = event.get('postback')
+    if postback is not None:
+        return MessageEvent(page_id, sender, recipient, None,
+                            postback.get('title'), timestamp, 'postback',
+                            postback.get('payload'))
+
+    for kind in ('delivery', 'read', 'optin'):
+        if kind in event:
+            return MessageEvent(page_id, sender, recipient, None, None,
+                                timestamp, kind)
+
+    return MessageEvent(page_id, sender, recipient, None, None,
+                        timestamp, 'unknown')
+
+
+def iter_message_events(payload, types=None):
+    """
+    Iterate over every event of a (batched) webhook delivery
+
+    :param payload: receives facebook object, type -> dict,
+                    or the raw request body, type -> bytes / str
+    :param types: Only yield events of these types, e.g. {'message'},
+                  not required
+    :return: a generator of MessageEvent objects
+    :raise ValueError: when the body is not JSON or not shaped
+    like a webhook delivery
+    """
+    if isinstance(payload, (bytes, bytearray, str)):
+        payload = json_loads(payload)
+
+    if not isinstance(payload, dict):
+        raise ValueError('A webhook delivery must be a JSON object')
+    if payload.get('object', 'page') != 'page':
+        return
+
+    entries = payload.get('entry') or ()
+    if not isinstance(entries, list):
+        raise ValueError('entry must be a list')
+    for entry in entries:
+        events = (entry.get('messaging') or ()) \
+            if isinstance(entry, dict) else None
+        if not isinstance(events, (list, tuple)):
+            raise ValueError('Every entry must be an object '
+                             'with a messaging list')
+        for event in events:
+            try:
+                parsed = _parse_event(entry.get('id'), event)
+            except (AttributeError, TypeError):
+                raise ValueError(f'Malformed messaging event {event!r}')
+            if types is None or parsed.type in types:
+                yield parsed
+
 
 def get_sender_id(data: dict) -> str:
     """
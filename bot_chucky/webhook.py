@@ -0,0 +1,291 @@
+""" Webhook app which acknowledges deliveries at once """
+
+import hashlib
+import hmac
+import logging
+import queue
+import threading
+from http import HTTPStatus
+from urllib import parse
+
+from .dedup import event_key
+from .errors import BotChuckyError
+from .helpers import ChuckyCustomGenerator
+from .utils import iter_message_events
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENT_TYPES = frozenset({'message', 'postback'})
+
+
+def verify_signature(app_secret, body: bytes, signature: str) -> bool:
+    """
+    :param app_secret: Facebook App Secret, type -> str
+    :param body: Raw request body, type -> bytes
+    :param signature: X-Hub-Signature ('sha1=...') or
+                      X-Hub-Signature-256 ('sha256=...') header value
+    :return: True when the body was signed with app_secret
+    """
+    if not signature or '=' not in signature:
+        return False
+    method, _, received = signature.partition('=')
+    if method not in ('sha1', 'sha256'):
+        return False
+    expected = hmac.new(app_secret.encode(), body,
+                        getattr(hashlib, method)).hexdigest()
+    return hmac.compare_digest(expected, received)
+
+
+def generator_handler(bot, generator, states=None):
+    """
+    :param bot: BotChucky instance used to reply
+    :param generator: ChuckyCustomGenerator instance
+    :param states: StateStore instance, the generator then gets
+                   the state of the sender, not required
+    :return: Event handler which replies with the generator result
+    """
+    def handle(event):
+        if event.text:
+            state = states.get(event.sender) if states is not None else None
+            bot.send_message(event.sender, generator(event.text, state=state))
+    return handle
+
+
+class EventDispatcher:
+    """
+    Class which runs an event handler on a bounded pool of worker
+    threads. When the queue is full new events are refused,
+    so a slow handler pushes back instead of piling up work.
+    """
+    def __init__(self, handler, workers=4, maxsize=1000):
+        """
+        :param handler: Function which takes a MessageEvent
+        :param workers: Number of worker threads, type -> int
+        :param maxsize: Max events waiting for a worker, type -> int
+        """
+        self.handler = handler
+        self._events = queue.Queue(maxsize)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True,
+                             name=f'bot-chucky-webhook-{i}')
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, event) -> bool:
+        """
+        :param event: MessageEvent object
+        :return: False when the queue is full or the dispatcher is closed
+        """
+        if self._closed:
+            return False
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    @property
+    def pending(self):
+        """
+        :return: Number of events waiting for a worker
+        """
+        return self._events.qsize()
+
+    def _worker(self):
+        while True:
+            event = self._events.get()
+            try:
+                if event is None:
+                    return
+                self.handler(event)
+            except Exception:
+                logger.exception('Webhook handler failed on %r', event)
+            finally:
+                self._events.task_done()
+
+    def join(self):
+        """
+        Block until every queued event was handled
+        """
+        self._events.join()
+
+    def shutdown(self, wait=True):
+        """
+        :param wait: Handle the queued events before returning
+        """
+        self._closed = True
+        for _ in self._threads:
+            self._events.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+class WebhookApp:
+    """
+    WSGI and ASGI webhook app. It answers the hub challenge, checks the
+    X-Hub-Signature, queues the events of a delivery and returns 200 at
+    once, the handler runs later on a bounded worker pool.
+    A 503 is returned when the pool is saturated, Facebook retries it.
+
+    :Example:
+          bot = BotChucky(token)
+          generator = ChuckyCustomGenerator(my_config)
+          app = WebhookApp(generator, verify_token='VERIFY_TOKEN',
+                           app_secret='APP_SECRET', bot=bot)
+          # gunicorn module:app, or uvicorn module:app.asgi
+    """
+    def __init__(self, handler, verify_token, app_secret=None, bot=None,
+                 workers=4, maxsize=1000, event_types=DEFAULT_EVENT_TYPES,
+                 dedup=None, dispatcher=None, states=None, recorder=None):
+        """
+        :param handler: Function which takes a MessageEvent,
+                        or a ChuckyCustomGenerator when bot is given
+        :param verify_token: Token set in the Facebook app settings
+        :param app_secret: App Secret, enables signature checks
+        :param bot: BotChucky instance used to reply, not required
+        :param workers: Number of worker threads, type -> int
+        :param maxsize: Max events waiting for a worker, type -> int
+        :param event_types: Event types passed to the handler
+        :param dedup: WindowDeduplicator or BloomDeduplicator instance,
+                      events Facebook delivers again are dropped
+        :param dispatcher: Object with submit(event) and shutdown(wait),
+                           e.g. ShardedDispatcher, which replaces the
+                           worker threads, handler is then unused
+        :param states: StateStore passed to a ChuckyCustomGenerator
+                       handler, not required
+        :param recorder: Recorder which saves every signed delivery
+                         for bot_chucky.replay, not required
+        """
+        if isinstance(handler, ChuckyCustomGenerator):
+            if bot is None:
+                raise BotChuckyError('A ChuckyCustomGenerator handler '
+                                     'needs a bot to reply with')
+            handler = generator_handler(bot, handler, states)
+        self.verify_token = verify_token
+        self.app_secret = app_secret
+        self.event_types = event_types
+        self.dedup = dedup
+        self.recorder = recorder
+        if dispatcher is None:
+            dispatcher = EventDispatcher(handler, workers, maxsize)
+        self.dispatcher = dispatcher
+
+    def verify(self, query: dict):
+        """
+        :param query: Query string parameters, type -> dict
+        :return: (status, body) of the verification request
+        """
+        if query.get('hub.mode') == 'subscribe' and \
+                hmac.compare_digest(query.get('hub.verify_token', '').encode(),
+                                    self.verify_token.encode()):
+            return 200, query.get('hub.challenge', '')
+        return 403, 'Verification token mismatch'
+
+    def receive(self, body: bytes, signature: str = None):
+        """
+        :param body: Raw request body, type -> bytes
+        :param signature: X-Hub-Signature header value
+        :return: (status, body) of the delivery request
+        """
+        if self.app_secret is not None and \
+                not verify_signature(self.app_secret, body, signature):
+            return 403, 'Invalid signature'
+
+        try:
+            events = list(iter_message_events(body, self.event_types))
+        except ValueError:
+            return 400, 'Invalid delivery'
+
+        if self.recorder is not None:
+            self.recorder.record(body)
+
+        for event in events:
+            key = None
+            if self.dedup is not None:
+                key = event_key(event)
+                if not self.dedup.add_if_absent(key):
+                    continue
+            if not self.dispatcher.submit(event):
+                # Only queued events are remembered, so an event refused
+                # with 503 is handled when Facebook delivers it again.
+                if key is not None:
+                    self.dedup.discard(key)
+                return 503, 'Busy'
+        return 200, 'ok'
+
+    def handle(self, method, query_string, body, headers):
+        """
+        :param method: HTTP method, type -> str
+        :param query_string: Raw query string, type -> str
+        :param body: Raw request body, type -> bytes
+        :param headers: Lower-cased request headers, type -> dict
+        :return: (status, body)
+        """
+        if method == 'GET':
+            return self.verify(dict(parse.parse_qsl(query_string)))
+        if method == 'POST':
+            signature = headers.get('x-hub-signature-256') or \
+                headers.get('x-hub-signature')
+            return self.receive(body, signature)
+        return 405, 'Method not allowed'
+
+    def __call__(self, environ, start_response):
+        """
+        WSGI entry point
+        """
+        method = environ['REQUEST_METHOD']
+        body = b''
+        if method == 'POST':
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length)
+        headers = {
+            'x-hub-signature': environ.get('HTTP_X_HUB_SIGNATURE'),
+            'x-hub-signature-256': environ.get('HTTP_X_HUB_SIGNATURE_256'),
+        }
+        status, text = self.handle(method, environ.get('QUERY_STRING', ''),
+                                   body, headers)
+        data = text.encode()
+        start_response(f'{status} {HTTPStatus(status).phrase}', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(data))),
+        ])
+        return [data]
+
+    async def asgi(self, scope, receive, send):
+        """
+        ASGI entry point
+        """
+        if scope['type'] != 'http':
+            return
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                   for key, value in scope.get('headers', ())}
+        status, text = self.handle(scope['method'],
+                                   scope.get('query_string', b'').decode(),
+                                   body, headers)
+        data = text.encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'),
+                        (b'content-length', str(len(data)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    def shutdown(self, wait=True):
+        """
+        :param wait: Handle the queued events before returning
+        """
+        self.dispatcher.shutdown(wait)
+        if self.recorder is not None:
+            self.recorder.close()
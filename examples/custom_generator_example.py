@@ -7,7 +7,7 @@ from flask import Flask, request
 
 from bot_chucky.bot import BotChucky
 from bot_chucky.helpers import ChuckyCustomGenerator
-from bot_chucky.utils import get_sender_id, get_user_text
+from bot_chucky.utils import iter_message_events
 
 token = 'YOUR_FACEBOOK_PAGE_TOKEN'
 
@@ -48,23 +48,20 @@ def handle_verification():
 
 @app.route('/', methods=['POST'])
 def handle_messages():
-    data = request.json
-    if data['object'] == 'page':
-        for entry in data['entry']:
-            for event in entry.get('messaging'):
-                if event.get('message'):
-                    # Get a user id
-                    sender_id = get_sender_id(data)
-                    # Get a user text
-                    text = get_user_text(data)
-
-                    # Call generator
-                    my_generator = chucky_generator(text)
-
-                    # Send message to a user
-                    bot.send_message(sender_id, my_generator)
-                if event.get('delivery'):
-                    pass
+    data = request.get_data()
+    # Facebook may batch many events into one delivery
+    for event in iter_message_events(data, types={'message'}):
+        if event.text:
+            # Get a user id
+            sender_id = event.sender
+            # Get a user text
+            text = event.text
+
+            # Call generator
+            my_generator = chucky_generator(text)
+
+            # Send message to a user
+            bot.send_message(sender_id, my_generator)
 
     return 'ok', 200
 
@@ -0,0 +1,28 @@
+"""
+Built-in webhook app, run it with any WSGI or ASGI server:
+
+    gunicorn webhook_example:app
+    uvicorn webhook_example:asgi_app
+"""
+
+from bot_chucky.bot import BotChucky
+from bot_chucky.helpers import ChuckyCustomGenerator
+from bot_chucky.webhook import WebhookApp
+
+token = 'YOUR_FACEBOOK_PAGE_TOKEN'
+
+bot = BotChucky(token)
+
+
+# Create own function
+def python_news():
+    return 'Hello! check please https://www.python.org/'
+
+
+chucky_generator = ChuckyCustomGenerator({'#Python': python_news})
+
+# Facebook gets 'ok' as soon as the events are queued,
+# the generator replies from a pool of 8 worker threads.
+app = WebhookApp(chucky_generator, verify_token='YOUR_VERIFY_TOKEN',
+                 app_secret='YOUR_APP_SECRET', bot=bot, workers=8)
+asgi_app = app.asgi
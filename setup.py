@@ -22,6 +22,7 @@ setup_kwargs = {
 
 requirements = ['requests==2.17.3', 'facebook-sdk==2.0.0']
 setup_kwargs['install_requires'] = requirements
+setup_kwargs['extras_require'] = {'async': ['aiohttp>=3.3']}
 
 setup(**setup_kwargs)
 